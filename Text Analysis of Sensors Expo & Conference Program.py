@@ -404,6 +404,9 @@ print(list(sessAbstractsDict.keys())[0:10])
 
 
 import nltk
+import nltkBundle
+nltkBundle.use_bundle()
+nltkBundle.require('stopwords', 'wordnet', 'averaged_perceptron_tagger')
 
 
 # At the end of these initial steps, the primary goal is to convert:
@@ -586,8 +589,6 @@ for sID in list(sessAbstractsDict.keys())[3:6]:
 from nltk.tag import pos_tag
 from nltk.corpus import wordnet
 from nltk.stem import WordNetLemmatizer
-nltk.download('wordnet')
-nltk.download('averaged_perceptron_tagger')
 
 wnl = nltk.WordNetLemmatizer()
 
@@ -0,0 +1,97 @@
+# coding: utf-8
+
+# Load test for queryServer.py.
+#
+# Opens `--connections` concurrent connections to a running query server and sends `--requests`
+# requests in total, drawn at random from the four query types over the exported artifacts (so the
+# response cache sees a realistic mix of repeats). With --batch N, requests are sent N at a time as a
+# JSON list. Reports p50/p90/p99 latency per round trip and overall requests per second.
+#
+# Usage:
+#
+#     python queryServer.py serve --artifact-dir artifacts &
+#     python loadTest.py --artifact-dir artifacts --requests 20000 --connections 16 --batch 1
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+
+def request_mix(artifactDir, count, seed=0):
+    rng = random.Random(seed)
+    with open(os.path.join(artifactDir, 'sessKeys.json'), encoding='utf-8') as f:
+        sessKeys = json.loads(f.read())
+    with open(os.path.join(artifactDir, 'topics.json'), encoding='utf-8') as f:
+        topics = list(json.loads(f.read()))
+    with open(os.path.join(artifactDir, 'lemmas.json'), encoding='utf-8') as f:
+        lemmas = json.loads(f.read())
+    requests = []
+    for i in range(count):
+        op = rng.choice(('topics', 'sessions', 'related', 'lemma'))
+        if op == 'topics':
+            requests.append({'op': op, 'session': rng.choice(sessKeys)})
+        elif op == 'sessions':
+            requests.append({'op': op, 'topic': rng.choice(topics), 'k': rng.choice((5, 10))})
+        elif op == 'related':
+            requests.append({'op': op, 'session': rng.choice(sessKeys), 'k': rng.choice((5, 10))})
+        else:
+            requests.append({'op': op, 'lemma': rng.choice(lemmas)})
+    return requests
+
+
+async def client(host, port, payloads, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    for payload in payloads:
+        t0 = time.perf_counter()
+        writer.write(json.dumps(payload).encode('utf-8') + b'\n')
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - t0)
+        for result in (response if isinstance(response, list) else [response]):
+            if 'error' in result:
+                errors.append(result['error'])
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_load(host, port, requests, connections, batch):
+    if batch > 1:
+        payloads = [requests[i:i + batch] for i in range(0, len(requests), batch)]
+    else:
+        payloads = requests
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    await asyncio.gather(*[client(host, port, payloads[c::connections], latencies, errors)
+                           for c in range(connections)])
+    return latencies, errors, time.perf_counter() - t0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the query server.')
+    parser.add_argument('--artifact-dir', default='artifacts')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    requests = request_mix(args.artifact_dir, args.requests)
+    latencies, errors, seconds = asyncio.run(run_load(args.host, args.port, requests, args.connections, args.batch))
+    ms = np.array(latencies) * 1000
+    print('Requests: %d in %d round trips over %d connections (batch %d)' % (
+        len(requests), len(latencies), args.connections, args.batch))
+    print('Latency per round trip: p50 %.3f ms  p90 %.3f ms  p99 %.3f ms  max %.3f ms' % (
+        np.percentile(ms, 50), np.percentile(ms, 90), np.percentile(ms, 99), ms.max()))
+    print('Throughput: %.0f requests/s' % (len(requests) / seconds))
+    if errors:
+        print('Errors:', len(errors), 'e.g.', errors[0])
+
+
+if __name__ == '__main__':
+    main()
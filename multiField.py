@@ -0,0 +1,169 @@
+# coding: utf-8
+
+# Multi-field corpus: track, session and talk titles analysed together with the session abstracts.
+#
+# The text analysis notebook walks progDict separately for trkTitle, sessTitle, talkTitle and
+# sessAbstract, and only the abstracts are tokenized and lemmatized. Here a single traversal collects
+# every text field at two granularities:
+#
+#     session   one document per session (SyyTxx) -- its track title, session title, abstract and the
+#               titles of all of its talks
+#     talk      one document per talk (TKzzSyyTxx) -- its track title, session title, the session abstract
+#               and its own title
+#
+# Every distinct text is tokenized and lemmatized once (track titles repeat for every session in the
+# track, and in tracks like T01 and T12 session and talk titles are often the same text), and the
+# lemmatizer results are cached per (word, POS class). The abstracts, by far the largest field, are
+# lemmatized by the pipeline's lemmas stage already, so their lemmas are seeded into the cache and only
+# the titles are tagged and lemmatized here. All fields share one vocabulary, so the per-field
+# bags of words can be combined into one weighted document-term matrix per granularity.
+
+from collections import Counter
+
+import tokenKernel
+
+FIELDS = ('trkTitle', 'sessTitle', 'sessAbstract', 'talkTitle')
+
+# titles are short and deliberately chosen, so a title lemma counts for more than an abstract lemma
+DEFAULT_FIELD_WEIGHTS = {'trkTitle': 0.5, 'sessTitle': 2.0, 'sessAbstract': 1.0, 'talkTitle': 1.0}
+
+
+def collect_fields(progDict):
+    """One traversal of progDict returning (sessFields, talkFields).
+
+    Each maps a document ID to {field: [texts]}; a session's talkTitle entry holds all its talk titles.
+    """
+    sessFields = {}
+    talkFields = {}
+    for tID in list(progDict.keys()):
+        trkTitle = progDict[tID]['trkTitle']
+        for sID, sess in progDict[tID]['sessions'].items():
+            talkTitles = [talk['talkTitle'] for talk in sess['sessTalks'].values()]
+            sessFields[sID] = {'trkTitle': [trkTitle], 'sessTitle': [sess['sessTitle']],
+                               'sessAbstract': [sess['sessAbstract']], 'talkTitle': talkTitles}
+            for tkID, talk in sess['sessTalks'].items():
+                talkFields[tkID] = {'trkTitle': [trkTitle], 'sessTitle': [sess['sessTitle']],
+                                    'sessAbstract': [sess['sessAbstract']], 'talkTitle': [talk['talkTitle']]}
+    return sessFields, talkFields
+
+
+class LemmaCache:
+    """Lemmas per distinct text, with WordNet lookups cached per (word, POS class)."""
+
+    def __init__(self, stopWords):
+        from nltk.stem import WordNetLemmatizer
+        self.stopWords = stopWords
+        self.wnl = WordNetLemmatizer()
+        self.textLemmas = {}
+        self.wordLemmas = {}
+        self.textHits = 0
+        self.seeded = 0
+
+    def seed(self, text, lemmaList):
+        """Store lemmas computed elsewhere (e.g. by the lemmas stage) for text."""
+        if text not in self.textLemmas:
+            self.textLemmas[text] = lemmaList
+            self.seeded += 1
+
+    def lemmatize(self, word, tag):
+        # same mapping as lemmatize_all in the text analysis notebook
+        if tag.startswith('NN'):
+            pos = 'n'
+        elif tag.startswith('VB'):
+            pos = 'v'
+        elif tag.startswith('JJ'):
+            pos = 'a'
+        else:
+            return word
+        key = (word, pos)
+        if key not in self.wordLemmas:
+            self.wordLemmas[key] = self.wnl.lemmatize(word, pos=pos)
+        return self.wordLemmas[key]
+
+    def lemmas(self, text):
+        if text in self.textLemmas:
+            self.textHits += 1
+            return self.textLemmas[text]
+        from nltk.tag import pos_tag
+        nonStopsList = tokenKernel.nonstop_tokens(text, self.stopWords)
+        lemmaStr = ' '.join(self.lemmatize(word, tag) for word, tag in pos_tag(nonStopsList))
+        self.textLemmas[text] = lemmaStr.split()
+        return self.textLemmas[text]
+
+
+def build_field_bows(progDict, lemmaCache=None, sessLemmas=None, skipSessions=()):
+    """Per-field lemma BOWs at session and talk granularity over one shared vocabulary.
+
+    sessLemmas ({sID: lemmas of the session abstract}, as produced by the lemmas stage) seeds the lemma
+    cache with the abstracts. Sessions in skipSessions are left out, together with their talks.
+    """
+    if lemmaCache is None:
+        lemmaCache = LemmaCache(tokenKernel.load_stop_words())
+    sessFields, talkFields = collect_fields(progDict)
+    if skipSessions:
+        sessFields = {sID: fields for sID, fields in sessFields.items() if sID not in skipSessions}
+        talkFields = {tkID: fields for tkID, fields in talkFields.items() if tkID[-6:] not in skipSessions}
+    for sID, lemmaList in (sessLemmas or {}).items():
+        if sID in sessFields:
+            lemmaCache.seed(sessFields[sID]['sessAbstract'][0], lemmaList)
+    vocab = {}
+    fieldBOWs = {}
+    for granularity, docFields in (('session', sessFields), ('talk', talkFields)):
+        fieldBOWs[granularity] = {field: {} for field in FIELDS}
+        for docID, fields in docFields.items():
+            for field, texts in fields.items():
+                bow = Counter()
+                for text in texts:
+                    bow.update(lemmaCache.lemmas(text))
+                for lemma in bow:
+                    if lemma not in vocab:
+                        vocab[lemma] = len(vocab)
+                fieldBOWs[granularity][field][docID] = dict(bow)
+    return {
+        'terms': sorted(vocab, key=vocab.get),
+        'docKeys': {'session': list(sessFields.keys()), 'talk': list(talkFields.keys())},
+        'fieldBOWs': fieldBOWs,
+        'cacheStats': {'distinctTexts': len(lemmaCache.textLemmas), 'seededTexts': lemmaCache.seeded,
+                       'textHits': lemmaCache.textHits, 'distinctWordLemmas': len(lemmaCache.wordLemmas)},
+    }
+
+
+def weighted_matrices(multiFieldBOW, fieldWeights=None):
+    """Combine the per-field BOWs into one weighted document-term csr_matrix per granularity."""
+    from scipy.sparse import csr_matrix
+
+    fieldWeights = dict(DEFAULT_FIELD_WEIGHTS, **(fieldWeights or {}))
+    termIndex = {term: i for i, term in enumerate(multiFieldBOW['terms'])}
+    matrices = {}
+    for granularity, docKeys in multiFieldBOW['docKeys'].items():
+        rowIndex = {docID: i for i, docID in enumerate(docKeys)}
+        rows, cols, vals = [], [], []
+        for field, bows in multiFieldBOW['fieldBOWs'][granularity].items():
+            weight = fieldWeights[field]
+            if not weight:
+                continue
+            for docID, bow in bows.items():
+                for lemma, count in bow.items():
+                    rows.append(rowIndex[docID])
+                    cols.append(termIndex[lemma])
+                    vals.append(weight * count)
+        # duplicate (row, col) entries from different fields are summed by csr_matrix
+        matrices[granularity] = csr_matrix((vals, (rows, cols)), shape=(len(docKeys), len(termIndex)))
+    return {'terms': multiFieldBOW['terms'], 'docKeys': multiFieldBOW['docKeys'], 'matrices': matrices,
+            'fieldWeights': fieldWeights}
+
+
+def weighted_tfidf(multiFieldMatrix, topLemmaCount, granularity='session'):
+    """TF-IDF of the weighted matrix restricted to the topLemmaCount heaviest lemmas.
+
+    Returns the same structure as the pipeline's tfidf stage so it can be fed to build_nmf.
+    """
+    import numpy as np
+    from sklearn.feature_extraction.text import TfidfTransformer
+
+    mat = multiFieldMatrix['matrices'][granularity]
+    totals = np.asarray(mat.sum(axis=0)).ravel()
+    topCols = np.sort(np.argsort(-totals, kind='stable')[0:topLemmaCount])
+    vMat = TfidfTransformer().fit_transform(mat[:, topCols]).toarray()
+    return {'sessKeys': multiFieldMatrix['docKeys'][granularity], 'vMat': vMat,
+            'terms': [multiFieldMatrix['terms'][i] for i in topCols]}
@@ -0,0 +1,123 @@
+# coding: utf-8
+
+# Near-duplicate detection for session abstracts (and any other token lists) with MinHash and LSH.
+#
+# Abstracts are often reused across tracks and years with small edits. Left in, they inflate the
+# FreqDist counts and pull the NMF topics towards the repeated text. Comparing every pair of abstracts
+# does not scale to a multi-year archive, so instead:
+#
+#   1. each document's tokens are cut into overlapping shingles of `shingle` tokens, and each shingle is
+#      hashed to 32 bits (crc32)
+#   2. the MinHash signature is the minimum of numPerm random linear hash functions (a * x + b) mod 2**32
+#      over those shingle hashes -- the fraction of positions on which two signatures agree estimates the Jaccard
+#      similarity of their shingle sets
+#   3. the signature is cut into `bands` bands; documents that agree on every row of at least one band
+#      land in the same LSH bucket and become candidate pairs
+#   4. candidates whose estimated similarity reaches the threshold are joined into clusters
+#
+# Each document is hashed and bucketed once, so the work grows linearly with the archive; only documents
+# that share a bucket are ever compared. With the defaults (128 permutations in 16 bands of 8 rows) pairs
+# with a Jaccard similarity around 0.7 and above are very likely to become candidates.
+
+import zlib
+
+import numpy as np
+
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingle_hashes(tokens, shingle=3):
+    """crc32 hashes of the overlapping shingles of tokens (the whole list if it is shorter, none if empty)."""
+    if not tokens:
+        return np.zeros(0, dtype=np.uint64)
+    if len(tokens) <= shingle:
+        grams = [' '.join(tokens)]
+    else:
+        grams = [' '.join(tokens[i:i + shingle]) for i in range(len(tokens) - shingle + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+class MinHashLSH:
+    """Incremental MinHash/LSH index; add() documents one at a time, in any number of batches."""
+
+    def __init__(self, threshold=0.8, numPerm=128, bands=16, shingle=3, seed=1):
+        if numPerm % bands:
+            raise ValueError('numPerm must be a multiple of bands')
+        self.threshold = threshold
+        self.numPerm = numPerm
+        self.bands = bands
+        self.rows = numPerm // bands
+        self.shingle = shingle
+        rng = np.random.RandomState(seed)
+        # a and b below 2**29 keep (a * x + b) for 32-bit x inside uint64 before it is cut to 32 bits
+        self.a = rng.randint(1, 1 << 29, size=numPerm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 29, size=numPerm).astype(np.uint64)
+        self.buckets = [{} for band in range(bands)]
+        self.signatures = {}
+        self.parent = {}
+        self.empty = []
+
+    def signature(self, tokens):
+        hashes = shingle_hashes(tokens, self.shingle)
+        perms = (np.outer(self.a, hashes) + self.b[:, None]) & MAX_HASH
+        return perms.min(axis=1)
+
+    def similarity(self, docID1, docID2):
+        """Jaccard similarity estimated from the two MinHash signatures."""
+        return float(np.mean(self.signatures[docID1] == self.signatures[docID2]))
+
+    def _find(self, docID):
+        while self.parent[docID] != docID:
+            self.parent[docID] = self.parent[self.parent[docID]]
+            docID = self.parent[docID]
+        return docID
+
+    def add(self, docID, tokens):
+        """Index one document and return the already indexed documents it near-duplicates.
+
+        A document without tokens has no shingles to compare; it is listed in self.empty and never
+        clustered (otherwise every empty abstract would be a duplicate of every other).
+        """
+        if not tokens:
+            self.empty.append(docID)
+            return []
+        sig = self.signature(tokens)
+        self.signatures[docID] = sig
+        self.parent[docID] = docID
+        candidates = set()
+        for band in range(self.bands):
+            bandKey = sig[band * self.rows:(band + 1) * self.rows].tobytes()
+            bucket = self.buckets[band].setdefault(bandKey, [])
+            candidates.update(bucket)
+            bucket.append(docID)
+        matches = [other for other in candidates if self.similarity(docID, other) >= self.threshold]
+        for other in matches:
+            rootOther, rootDoc = self._find(other), self._find(docID)
+            if rootOther != rootDoc:
+                self.parent[rootDoc] = rootOther
+        return matches
+
+    def clusters(self):
+        """Clusters of two or more near-duplicates, each listed in the order documents were added."""
+        groups = {}
+        for docID in self.signatures:
+            groups.setdefault(self._find(docID), []).append(docID)
+        return [group for group in groups.values() if len(group) > 1]
+
+
+def find_near_duplicates(docTokens, threshold=0.8, numPerm=128, bands=16, shingle=3):
+    """Near-duplicate clusters over {docID: tokens}.
+
+    Returns {'clusters': [[docID, ...], ...], 'duplicateOf': {docID: representative}, 'empty': [docID, ...]}
+    where the representative of a cluster is its first document in docTokens order. Documents without
+    tokens (e.g. a session with no abstract) are listed in 'empty' and are in no cluster.
+    """
+    lsh = MinHashLSH(threshold, numPerm, bands, shingle)
+    for docID, tokens in docTokens.items():
+        lsh.add(docID, tokens)
+    clusters = lsh.clusters()
+    duplicateOf = {}
+    for cluster in clusters:
+        for docID in cluster[1:]:
+            duplicateOf[docID] = cluster[0]
+    return {'clusters': clusters, 'duplicateOf': duplicateOf, 'empty': lsh.empty}
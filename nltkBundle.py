@@ -0,0 +1,114 @@
+# coding: utf-8
+
+# Offline NLTK resource bundle.
+#
+# The notebooks call nltk.download('wordnet') and nltk.download('averaged_perceptron_tagger') every
+# time they run, which hangs or fails on machines without network access. Instead, the resources are
+# kept in a local bundle directory (by default ./nltk_data, or $SENSORS_NLTK_DATA) that is built once
+# on a connected machine:
+#
+#     python nltkBundle.py build [bundleDir]
+#
+# and checked -- never downloaded -- at run time with require(). The check looks at the bundle on the
+# file system first, so it does not need to import nltk itself; NLTK's own search path is only
+# consulted (which does import nltk) when a resource is not in the bundle.
+
+import os
+import re
+import sys
+from importlib import metadata
+
+DEFAULT_BUNDLE_DIR = os.environ.get('SENSORS_NLTK_DATA', 'nltk_data')
+
+
+def tagger_path():
+    """The tagger pos_tag loads with the installed NLTK: NLTK 3.9 and later only read the '_eng' one."""
+    try:
+        version = tuple(int(part) for part in re.findall(r'\d+', metadata.version('nltk'))[0:2])
+    except metadata.PackageNotFoundError:
+        version = (0, 0)
+    if version >= (3, 9):
+        return 'taggers/averaged_perceptron_tagger_eng'
+    return 'taggers/averaged_perceptron_tagger'
+
+
+# resource name -> the paths, relative to an nltk_data directory, that satisfy it
+RESOURCES = {
+    'stopwords': ['corpora/stopwords'],
+    'wordnet': ['corpora/wordnet'],
+    'averaged_perceptron_tagger': [tagger_path()],
+}
+
+bundleDir = DEFAULT_BUNDLE_DIR
+
+
+def use_bundle(path=None):
+    """Make path (default $SENSORS_NLTK_DATA or ./nltk_data) the first place NLTK looks for data."""
+    global bundleDir
+    bundleDir = os.path.abspath(path or DEFAULT_BUNDLE_DIR)
+    if 'nltk' in sys.modules:
+        import nltk
+        if bundleDir not in nltk.data.path:
+            nltk.data.path.insert(0, bundleDir)
+    else:
+        # nltk reads NLTK_DATA when it is first imported
+        dataPath = os.environ.get('NLTK_DATA')
+        os.environ['NLTK_DATA'] = bundleDir if not dataPath else bundleDir + os.pathsep + dataPath
+    return bundleDir
+
+
+def in_bundle(name):
+    for relPath in RESOURCES[name]:
+        fullPath = os.path.join(bundleDir, *relPath.split('/'))
+        if os.path.isdir(fullPath) or os.path.isfile(fullPath + '.zip'):
+            return True
+    return False
+
+
+def missing_resources(*names):
+    """The names (default: all RESOURCES) found neither in the bundle nor on NLTK's search path."""
+    missing = []
+    for name in names or RESOURCES.keys():
+        if in_bundle(name):
+            continue
+        import nltk
+        found = False
+        for relPath in RESOURCES[name]:
+            try:
+                nltk.data.find(relPath)
+                found = True
+                break
+            except LookupError:
+                pass
+        if not found:
+            missing.append(name)
+    return missing
+
+
+def require(*names):
+    """Raise LookupError naming every missing resource instead of trying to download it."""
+    missing = missing_resources(*names)
+    if missing:
+        raise LookupError('NLTK resources not found in bundle ' + bundleDir + ': ' + ', '.join(missing) +
+                          '. Build the bundle on a connected machine with: python nltkBundle.py build ' + bundleDir)
+
+
+def build(path=None):
+    """Download every resource into the bundle directory (run once, on a machine with network access)."""
+    import nltk
+    path = os.path.abspath(path or DEFAULT_BUNDLE_DIR)
+    for name, relPaths in RESOURCES.items():
+        for relPath in relPaths:
+            nltk.download(relPath.split('/')[-1], download_dir=path)
+    return path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'build':
+        print('Bundle written to', build(sys.argv[2] if len(sys.argv) > 2 else None))
+    else:
+        use_bundle(sys.argv[1] if len(sys.argv) > 1 else None)
+        missing = missing_resources()
+        print('Bundle:', bundleDir)
+        print('Missing resources:', missing if missing else 'none')
+        sys.exit(1 if missing else 0)
@@ -0,0 +1,216 @@
+# coding: utf-8
+
+# Extraction of progDict from the raw schedule text.
+#
+# The README describes the data flow as: copy the conference listing into a text file, extract the
+# tracks, sessions, abstracts, talks and speakers, and store the result as progDict. This module is that
+# extraction step. It reads one or more raw program files, each laid out as labelled lines
+#
+#     Track: Pre-Conference Designing for the Industrial & Embedded IoT
+#     Session: Pre-Conference Symposium 1 - MEMS and Sensor Technologies Coming to an IoT Solution
+#     Abstract: This symposium will provide a 'state of the union' of the MEMS and sensors industry
+#       including a look at ...                  (continuation lines are indented and appended)
+#     Talk: Welcome & Introduction
+#     Speakers: Stephen Whalley
+#     Talk: MEMS & Sensor Market Overview
+#     Speakers:
+#       Manuel Tagliavini, Senior Principal Analyst, IHS Markit     (one per line: name, position, company)
+#
+# A label is only recognised at the very start of a line and in the case given in LAYOUTS, so an
+# indented continuation line that happens to begin with "talk:" stays part of the text above it.
+#
+# The entries are keyed with the Txx / SyyTxx / TKzzSyyTxx structure used by progDict.json:
+#
+#     {'T01': {'trkTitle': ..., 'sessions': {'S00T01': {'sessTitle': ..., 'sessAbstract': ...,
+#              'sessTalks': {'TK00S00T01': {'talkTitle': ..., 'talkSpeakers': [...]}}}}}}
+#
+# A labelled line may carry its ID before the colon ("Track T00:", "Session S06T00:", "Talk TK00S06T00:").
+# Without one, entries are numbered in order of appearance. Numbering cannot reproduce the gaps in an
+# existing program (progDict.json has an S06T00 but no S05T00), so to keep session keys stable across the
+# stage cache, the trend store and the query server, give the IDs explicitly when re-extracting a program
+# that has already been analysed.
+#
+# A session with no Talk lines (e.g. a workshop) becomes a single talk with the session title, as in
+# tracks T01 and T12 of the 2018 program. Other event variants that label their lines differently are
+# handled by adding an entry to LAYOUTS.
+#
+# Many program files are extracted concurrently in a process pool and each progDict is streamed
+# straight into the pipeline (sensorsPipeline.run_pipeline(progDict=...)) without writing progDict.json.
+#
+# Usage:
+#
+#     python progExtractor.py program2018.txt program2019.txt --workers 4 --analyze
+#     python progExtractor.py program2019.txt --json-dir extracted/
+
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# line labels for each event variant: field -> label
+LAYOUTS = {
+    'default': {'track': 'Track', 'session': 'Session', 'abstract': 'Abstract', 'talk': 'Talk',
+                'speakers': 'Speakers'},
+}
+
+
+def layout_pattern(layout):
+    labels = LAYOUTS[layout]
+    alternatives = '|'.join(re.escape(label) for label in labels.values())
+    return re.compile(r'^(' + alternatives + r')(?:[ \t]+([^\s:]+))?[ \t]*:\s*(.*?)\s*$'), \
+        {label: field for field, label in labels.items()}
+
+
+def entry_id(explicitID, entries, prefix, suffix):
+    """explicitID checked to be prefix + number + parent ID (suffix), or the next unused such ID."""
+    if explicitID is not None:
+        if re.fullmatch(re.escape(prefix) + r'\d+' + re.escape(suffix), explicitID) is None:
+            raise ValueError('ID ' + explicitID + ' is not ' + prefix + '<number>' + suffix)
+        if explicitID in entries:
+            raise ValueError('duplicate ID ' + explicitID)
+        return explicitID
+    n = len(entries)
+    while prefix + '%02d' % n + suffix in entries:
+        n += 1
+    return prefix + '%02d' % n + suffix
+
+
+def read_text(rawFile):
+    # the original listing was saved on Windows; accept either encoding
+    with open(rawFile, 'rb') as f:
+        raw = f.read()
+    try:
+        return raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return raw.decode('cp1252')
+
+
+def split_speakers(text):
+    """Speaker names from ';'-separated "name, position, company" entries -- only the name is kept."""
+    return [entry.split(',')[0].strip() for entry in re.split(r'[;\n]', text) if entry.split(',')[0].strip()]
+
+
+def parse_program(text, layout='default'):
+    """Parse raw schedule text into a progDict."""
+    pattern, fieldForLabel = layout_pattern(layout)
+    progDict = {}
+    trk = sess = talk = None
+    lastField = None
+
+    def finish_session():
+        if sess is not None and not sess['sessTalks']:
+            talkID = 'TK00' + sessID
+            sess['sessTalks'][talkID] = {'talkTitle': sess['sessTitle'], 'talkSpeakers': sess.pop('_speakers', [])}
+        if sess is not None:
+            sess.pop('_speakers', None)
+
+    for line in text.splitlines():
+        match = pattern.match(line)
+        if match is None:
+            value = line.strip()
+            if not value or lastField is None:
+                continue
+            # continuation of the last labelled line
+            if lastField == 'speakers':
+                target = talk if talk is not None else sess
+                key = 'talkSpeakers' if talk is not None else '_speakers'
+                # block form: one "name, position, company" entry per line
+                target.setdefault(key, []).extend(split_speakers(value))
+            elif lastField == 'abstract':
+                sess['sessAbstract'] = (sess['sessAbstract'] + ' ' + value).strip()
+            elif lastField == 'talk':
+                talk['talkTitle'] += ' ' + value
+            elif lastField == 'session':
+                sess['sessTitle'] += ' ' + value
+            elif lastField == 'track':
+                trk['trkTitle'] += ' ' + value
+            continue
+
+        field = fieldForLabel[match.group(1)]
+        explicitID, value = match.group(2), match.group(3)
+        if explicitID is not None and field not in ('track', 'session', 'talk'):
+            raise ValueError(match.group(1) + ' lines take no ID: ' + line.strip()[0:60])
+        if field == 'track':
+            finish_session()
+            trkID = entry_id(explicitID, progDict, 'T', '')
+            trk = progDict[trkID] = {'trkTitle': value, 'sessions': {}}
+            sess = talk = None
+        elif field == 'session':
+            if trk is None:
+                raise ValueError('Session before any Track: ' + value)
+            finish_session()
+            sessID = entry_id(explicitID, trk['sessions'], 'S', trkID)
+            sess = trk['sessions'][sessID] = {'sessTitle': value, 'sessAbstract': '', 'sessTalks': {}}
+            talk = None
+        elif field == 'abstract':
+            if sess is None:
+                raise ValueError('Abstract outside a Session: ' + value[0:60])
+            sess['sessAbstract'] = value
+        elif field == 'talk':
+            if sess is None:
+                raise ValueError('Talk outside a Session: ' + value)
+            talkID = entry_id(explicitID, sess['sessTalks'], 'TK', sessID)
+            talk = sess['sessTalks'][talkID] = {'talkTitle': value, 'talkSpeakers': []}
+        elif field == 'speakers':
+            if sess is None:
+                raise ValueError('Speakers outside a Session: ' + value)
+            if talk is not None:
+                talk['talkSpeakers'] = split_speakers(value)
+            else:
+                sess['_speakers'] = split_speakers(value)
+        lastField = field
+    finish_session()
+    return progDict
+
+
+def extract_file(rawFile, layout='default'):
+    return rawFile, parse_program(read_text(rawFile), layout)
+
+
+def extract_programs(rawFiles, workers=None, layout='default'):
+    """Extract rawFiles in a process pool, yielding (rawFile, progDict) as each one finishes."""
+    if len(rawFiles) == 1:
+        yield extract_file(rawFiles[0], layout)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(extract_file, rawFile, layout) for rawFile in rawFiles]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def program_counts(progDict):
+    sessCnt = sum(len(trk['sessions']) for trk in progDict.values())
+    talkCnt = sum(len(sess['sessTalks']) for trk in progDict.values() for sess in trk['sessions'].values())
+    return len(progDict), sessCnt, talkCnt
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Extract progDict from raw schedule text files.')
+    parser.add_argument('rawFiles', nargs='+')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--layout', default='default', choices=sorted(LAYOUTS))
+    parser.add_argument('--json-dir', default=None, help='also write <name>.json progDicts here')
+    parser.add_argument('--analyze', action='store_true', help='run the analysis pipeline on each program')
+    parser.add_argument('--cache-dir', default='stageCache')
+    args = parser.parse_args()
+
+    if args.analyze:
+        import nltkBundle
+        from sensorsPipeline import run_pipeline
+        from stageCache import StageCache
+        nltkBundle.use_bundle()
+        cache = StageCache(args.cache_dir)
+
+    for rawFile, progDict in extract_programs(args.rawFiles, args.workers, args.layout):
+        print(rawFile, '-- tracks: %d sessions: %d talks: %d' % program_counts(progDict))
+        if args.json_dir:
+            os.makedirs(args.json_dir, exist_ok=True)
+            jsonFile = os.path.join(args.json_dir, os.path.splitext(os.path.basename(rawFile))[0] + '.json')
+            with open(jsonFile, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(progDict, indent=2, ensure_ascii=False))
+        if args.analyze:
+            outputs, runner = run_pipeline(progDict=progDict, targets=['nmf'], cache=cache)
+            for topic, lemmas in outputs['nmf']['topLemmasPerTopic'].items():
+                print('  ', topic, lemmas)
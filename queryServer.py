@@ -0,0 +1,299 @@
+# coding: utf-8
+
+# Local query service over the topic modeling results.
+#
+# The results of the topic notebook (docTopic, topicsDict, cosSimMat, top10LemmasPerTopic) are only
+# available by re-running it. Here they are exported once from the pipeline into an artifact directory
+#
+#     sessKeys.json    session IDs, in the row order of the arrays below
+#     sessTitles.json  session ID -> session title
+#     topics.json      topic -> top lemmas
+#     docTopic.npy     sessions x topics normalized NMF weights (float32)
+#     cosSimMat.npy    sessions x sessions cosine similarities (float32)
+#     lemmas.json      sorted lemma list, plus lemmaPtr.npy / lemmaDocs.npy: a CSR inverted index
+#                      (the sessions mentioning lemmas[i] are lemmaDocs[lemmaPtr[i]:lemmaPtr[i + 1]])
+#
+# and served by an asyncio server that memory-maps the arrays at startup. The protocol is one JSON
+# value per line: a request object, or a list of request objects answered together as a batch.
+#
+#     {"op": "topics",   "session": "S00T03"}            topics and weights for a session
+#     {"op": "sessions", "topic": "T2", "k": 10}          sessions with the most weight on a topic
+#     {"op": "related",  "session": "S00T03", "k": 10}    most similar sessions (cosine similarity)
+#     {"op": "lemma",    "lemma": "lidar"}                sessions whose abstract mentions a lemma
+#
+# Responses are kept in an LRU cache keyed by the request, and the uncached 'related' requests of a
+# batch are answered with one partial sort over the stacked similarity rows.
+#
+# Usage:
+#
+#     python queryServer.py export --artifact-dir artifacts
+#     python queryServer.py serve --artifact-dir artifacts --port 8765
+#     python loadTest.py --port 8765
+
+import asyncio
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+def export_artifacts(outputs, artifactDir='artifacts'):
+    """Write the query artifacts from pipeline outputs ('progDict', 'sessLemmasDict', 'cosine', 'nmf')."""
+    os.makedirs(artifactDir, exist_ok=True)
+    nmfOut = outputs['nmf']
+    sessKeys = list(nmfOut['sessKeys'])
+    sessTitles = {}
+    for tID in list(outputs['progDict'].keys()):
+        for sID, sess in outputs['progDict'][tID]['sessions'].items():
+            sessTitles[sID] = sess['sessTitle']
+
+    lemmaDocs = {}
+    for row, sID in enumerate(sessKeys):
+        for lemma in outputs['sessLemmasDict'][sID]['sessLemmaBOW']:
+            lemmaDocs.setdefault(lemma, []).append(row)
+    lemmas = sorted(lemmaDocs)
+    lemmaPtr = np.zeros(len(lemmas) + 1, dtype=np.int64)
+    lemmaPtr[1:] = np.cumsum([len(lemmaDocs[lemma]) for lemma in lemmas])
+    docs = np.array([row for lemma in lemmas for row in lemmaDocs[lemma]], dtype=np.int32)
+
+    np.save(os.path.join(artifactDir, 'docTopic.npy'), nmfOut['docTopic'].astype(np.float32))
+    np.save(os.path.join(artifactDir, 'cosSimMat.npy'), np.asarray(outputs['cosine'], dtype=np.float32))
+    np.save(os.path.join(artifactDir, 'lemmaPtr.npy'), lemmaPtr)
+    np.save(os.path.join(artifactDir, 'lemmaDocs.npy'), docs)
+    for fileName, value in (('sessKeys.json', sessKeys),
+                            ('sessTitles.json', {sID: sessTitles.get(sID, '') for sID in sessKeys}),
+                            ('topics.json', nmfOut['topLemmasPerTopic']),
+                            ('lemmas.json', lemmas)):
+        with open(os.path.join(artifactDir, fileName), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(value, ensure_ascii=False))
+    return artifactDir
+
+
+class QueryError(Exception):
+    pass
+
+
+def request_k(request):
+    """The 'k' of a request (default 10) as a non-negative int, or QueryError."""
+    k = request.get('k', 10)
+    try:
+        if isinstance(k, bool) or not isinstance(k, (int, str)):
+            raise ValueError
+        k = int(k)
+    except ValueError:
+        raise QueryError('k must be a non-negative integer, got ' + json.dumps(k))
+    if k < 0:
+        raise QueryError('k must be a non-negative integer, got ' + str(k))
+    return k
+
+
+class Artifacts:
+    """The exported artifacts, with the arrays memory-mapped rather than read into memory."""
+
+    def __init__(self, artifactDir='artifacts'):
+        def read_json(fileName):
+            with open(os.path.join(artifactDir, fileName), encoding='utf-8') as f:
+                return json.loads(f.read())
+
+        def load(fileName):
+            return np.load(os.path.join(artifactDir, fileName), mmap_mode='r')
+
+        self.sessKeys = read_json('sessKeys.json')
+        self.sessTitles = read_json('sessTitles.json')
+        self.topics = read_json('topics.json')
+        self.lemmas = read_json('lemmas.json')
+        self.sessIndex = {sID: i for i, sID in enumerate(self.sessKeys)}
+        self.topicIndex = {topic: i for i, topic in enumerate(self.topics)}
+        self.lemmaIndex = {lemma: i for i, lemma in enumerate(self.lemmas)}
+        self.docTopic = load('docTopic.npy')
+        self.cosSimMat = load('cosSimMat.npy')
+        self.lemmaPtr = load('lemmaPtr.npy')
+        self.lemmaDocs = load('lemmaDocs.npy')
+
+    def session_row(self, request):
+        sID = request.get('session')
+        if sID not in self.sessIndex:
+            raise QueryError('unknown session: ' + str(sID))
+        return self.sessIndex[sID]
+
+    def session_entry(self, row, score=None):
+        sID = self.sessKeys[row]
+        entry = {'session': sID, 'title': self.sessTitles.get(sID, '')}
+        if score is not None:
+            entry['score'] = round(float(score), 4)
+        return entry
+
+
+class QueryEngine:
+    """Answers requests against Artifacts, with an LRU response cache."""
+
+    def __init__(self, artifacts, cacheSize=4096):
+        self.art = artifacts
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_get(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+        return None
+
+    def _cache_put(self, key, response):
+        self.cache[key] = response
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+    def topics(self, request):
+        weights = self.art.docTopic[self.art.session_row(request)]
+        order = np.argsort(-weights, kind='stable')
+        topicNames = list(self.art.topics)
+        return {'topics': [{'topic': topicNames[i], 'weight': round(float(weights[i]), 4),
+                            'lemmas': self.art.topics[topicNames[i]]} for i in order]}
+
+    def sessions(self, request):
+        topic = request.get('topic')
+        if topic not in self.art.topicIndex:
+            raise QueryError('unknown topic: ' + str(topic))
+        k = request_k(request)
+        weights = np.asarray(self.art.docTopic[:, self.art.topicIndex[topic]])
+        top = top_k(weights, k)
+        return {'sessions': [self.art.session_entry(row, weights[row]) for row in top]}
+
+    def lemma(self, request):
+        lemmaID = self.art.lemmaIndex.get(request.get('lemma'))
+        if lemmaID is None:
+            return {'sessions': []}
+        rows = self.art.lemmaDocs[self.art.lemmaPtr[lemmaID]:self.art.lemmaPtr[lemmaID + 1]]
+        return {'sessions': [self.art.session_entry(int(row)) for row in rows]}
+
+    def related_batch(self, queries):
+        """Answer several validated (session row, k) 'related' queries with one partial sort."""
+        rows = np.array([row for row, k in queries])
+        sims = np.array(self.art.cosSimMat[rows], dtype=np.float32)
+        sims[np.arange(len(rows)), rows] = -np.inf  # a session is not related to itself
+        kMax = min(max(k for row, k in queries), sims.shape[1] - 1)
+        part = np.argpartition(-sims, kMax - 1, axis=1)[:, 0:kMax] if kMax > 0 else np.zeros((len(rows), 0), dtype=int)
+        responses = []
+        for i, (row, k) in enumerate(queries):
+            cand = part[i][np.argsort(-sims[i, part[i]], kind='stable')][0:k]
+            responses.append({'related': [self.art.session_entry(col, sims[i, col]) for col in cand]})
+        return responses
+
+    def handle_batch(self, requests):
+        responses = [None] * len(requests)
+        related = []
+        for i, request in enumerate(requests):
+            if not isinstance(request, dict):
+                responses[i] = {'error': 'request must be a JSON object'}
+                continue
+            key = json.dumps(request, sort_keys=True)
+            cached = self._cache_get(key)
+            if cached is not None:
+                responses[i] = cached
+                continue
+            op = request.get('op')
+            try:
+                if op == 'related':
+                    related.append((i, key, (self.art.session_row(request), request_k(request))))
+                    continue
+                if op == 'topics':
+                    response = self.topics(request)
+                elif op == 'sessions':
+                    response = self.sessions(request)
+                elif op == 'lemma':
+                    response = self.lemma(request)
+                else:
+                    raise QueryError('unknown op: ' + str(op))
+            except (QueryError, ValueError, TypeError) as e:
+                responses[i] = {'error': str(e)}
+                continue
+            self._cache_put(key, response)
+            responses[i] = response
+        if related:
+            for (i, key, query), response in zip(related, self.related_batch([q for i, k, q in related])):
+                self._cache_put(key, response)
+                responses[i] = response
+        return responses
+
+    def handle(self, request):
+        return self.handle_batch([request])[0]
+
+
+def top_k(values, k):
+    k = min(k, len(values))
+    if k <= 0:
+        return []
+    part = np.argpartition(-values, k - 1)[0:k]
+    return part[np.argsort(-values[part], kind='stable')].tolist()
+
+
+async def serve(engine, host='127.0.0.1', port=8765):
+
+    async def handle_client(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    payload = json.loads(line)
+                except ValueError:
+                    result = {'error': 'invalid JSON'}
+                else:
+                    try:
+                        if isinstance(payload, list):
+                            result = engine.handle_batch(payload)
+                        else:
+                            result = engine.handle(payload)
+                    except Exception as e:
+                        # a bug in one request must not drop the connection (and the rest of its batch)
+                        result = {'error': 'internal error: ' + type(e).__name__ + ': ' + str(e)}
+                writer.write(json.dumps(result).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionResetError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_client, host, port)
+    print('Serving', len(engine.art.sessKeys), 'sessions and', len(engine.art.topics), 'topics on', host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Related-session and topic query server.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    exportParser = sub.add_parser('export', help='export the artifacts from the (cached) pipeline')
+    exportParser.add_argument('--artifact-dir', default='artifacts')
+    exportParser.add_argument('--cache-dir', default='stageCache')
+    exportParser.add_argument('--topics', type=int, default=5)
+    serveParser = sub.add_parser('serve')
+    serveParser.add_argument('--artifact-dir', default='artifacts')
+    serveParser.add_argument('--host', default='127.0.0.1')
+    serveParser.add_argument('--port', type=int, default=8765)
+    serveParser.add_argument('--cache-size', type=int, default=4096)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        import nltkBundle
+        from sensorsPipeline import run_pipeline
+        from stageCache import StageCache
+        nltkBundle.use_bundle()
+        outputs, runner = run_pipeline({'numOfTopics': args.topics},
+                                       targets=['progDict', 'sessLemmasDict', 'cosine', 'nmf'],
+                                       cache=StageCache(args.cache_dir))
+        print('Artifacts written to', export_artifacts(outputs, args.artifact_dir))
+    else:
+        engine = QueryEngine(Artifacts(args.artifact_dir), args.cache_size)
+        try:
+            asyncio.run(serve(engine, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,235 @@
+# coding: utf-8
+
+# Headless rendering of the notebook figures.
+#
+# The notebooks draw their figures inline -- fDistLemma.plot(45) and its cumulative version, the bigram
+# frequency plots, sns.heatmap(cosSimMat), the ward dendrogram and the stacked docTopic bar chart -- which
+# blocks the analysis and redraws every figure on every run. Here each figure is described by a small
+# spec (a kind plus the data it needs), the specs are rendered to PNG files by a pool of worker processes
+# using matplotlib's Agg backend, and each file name carries a hash of the spec so that a figure whose
+# data did not change is not drawn again.
+#
+# Large inputs are reduced before they are handed to the workers: the cosine similarity matrix is
+# block-averaged to at most maxCells x maxCells, the dendrogram shows the last maxLeaves merged clusters,
+# and the stacked topic bars are averaged per track when there are more than maxBars sessions.
+#
+# Usage:
+#
+#     python reportRenderer.py figures/
+#     python sensorsPipeline.py --figures figures/
+
+import hashlib
+import os
+import pickle
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+FIGURE_VERSION = 1
+
+
+def block_mean(mat, maxCells):
+    """Average mat over a grid of at most maxCells x maxCells blocks."""
+    nRows, nCols = mat.shape
+    if nRows <= maxCells and nCols <= maxCells:
+        return mat
+    rowEdges = np.linspace(0, nRows, min(nRows, maxCells) + 1).astype(int)[:-1]
+    colEdges = np.linspace(0, nCols, min(nCols, maxCells) + 1).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(mat, rowEdges, axis=0), colEdges, axis=1)
+    rowSizes = np.diff(np.append(rowEdges, nRows))
+    colSizes = np.diff(np.append(colEdges, nCols))
+    return sums / np.outer(rowSizes, colSizes)
+
+
+def track_means(docTopic, sessKeys):
+    """Average topic weights per track (the last three characters of a session key, e.g. T03)."""
+    trkIDs = sorted(set(sID[-3:] for sID in sessKeys))
+    trkIndex = {trkID: i for i, trkID in enumerate(trkIDs)}
+    rows = np.array([trkIndex[sID[-3:]] for sID in sessKeys])
+    sums = np.zeros((len(trkIDs), docTopic.shape[1]))
+    np.add.at(sums, rows, docTopic)
+    return sums / np.bincount(rows, minlength=len(trkIDs))[:, None], trkIDs
+
+
+def figure_specs(outputs, stopWords=frozenset(), topN=45, maxCells=64, maxLeaves=40, maxBars=60):
+    """Figure specs for whichever pipeline outputs are present, keyed by figure name."""
+    specs = {}
+    if 'sessLemmasDict' in outputs:
+        fDistLemma = Counter()
+        for sID, entry in outputs['sessLemmasDict'].items():
+            fDistLemma.update(entry['sessLemmaBOW'])
+        top = fDistLemma.most_common(topN)
+        specs['lemmaFreq'] = {'kind': 'freq', 'labels': [w for w, c in top], 'counts': [c for w, c in top],
+                              'cumulative': False, 'title': str(topN) + ' Most Common Lemmas'}
+        specs['lemmaFreqCumulative'] = dict(specs['lemmaFreq'], cumulative=True,
+                                            title=str(topN) + ' Most Common Lemmas (cumulative)')
+    if 'ngrams' in outputs:
+        fDistBigrams = Counter()
+        for sID, entry in outputs['ngrams'].items():
+            fDistBigrams.update(bgram for bgram in entry['sessAbstractBigrams']
+                                if bgram[0] not in stopWords and bgram[1] not in stopWords)
+        top = fDistBigrams.most_common(topN)
+        specs['bigramFreq'] = {'kind': 'freq', 'labels': [' '.join(b) for b, c in top],
+                               'counts': [c for b, c in top], 'cumulative': False,
+                               'title': str(topN) + ' Most Common Bigrams'}
+        specs['bigramFreqCumulative'] = dict(specs['bigramFreq'], cumulative=True,
+                                             title=str(topN) + ' Most Common Bigrams (cumulative)')
+    if 'cosine' in outputs:
+        cosSimMat = np.asarray(outputs['cosine'])
+        specs['cosineHeatmap'] = {'kind': 'heatmap', 'mat': block_mean(cosSimMat, maxCells),
+                                  'title': 'Cosine Similarities among ' + str(len(cosSimMat)) + ' Session Abstracts'}
+        specs['dendrogram'] = {'kind': 'dendrogram', 'mat': cosSimMat, 'maxLeaves': maxLeaves,
+                               'title': 'Ward Clustering of Session Abstracts'}
+    if 'nmf' in outputs:
+        docTopic = outputs['nmf']['docTopic']
+        sessKeys = outputs['nmf']['sessKeys']
+        if len(sessKeys) > maxBars:
+            docTopic, sessKeys = track_means(docTopic, sessKeys)
+        specs['docTopicBars'] = {'kind': 'stacked', 'mat': docTopic, 'labels': list(sessKeys),
+                                 'columns': ['T' + str(i) for i in range(docTopic.shape[1])],
+                                 'title': 'Topic Proportions'}
+    return specs
+
+
+def spec_digest(spec):
+    return hashlib.sha256(pickle.dumps((FIGURE_VERSION, spec), protocol=4)).hexdigest()[:16]
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_figure(spec, pngFile, timings=None):
+    """Draw one spec to pngFile (runs in a worker process).
+
+    When a timings dictionary is given, the seconds spent in ward clustering ('ward') and in drawing and
+    saving the figure ('draw') are stored in it.
+    """
+    import matplotlib.pyplot as plt
+
+    t0 = time.perf_counter()
+    kind = spec['kind']
+    if kind == 'freq':
+        counts = np.cumsum(spec['counts']) if spec['cumulative'] else spec['counts']
+        fig, ax = plt.subplots(figsize=(12, 5))
+        ax.plot(range(len(counts)), counts)
+        ax.set_xticks(range(len(counts)))
+        ax.set_xticklabels(spec['labels'], rotation=90)
+        ax.set_ylabel('Cumulative Counts' if spec['cumulative'] else 'Counts')
+        ax.grid(True, alpha=.3)
+    elif kind == 'heatmap':
+        fig, ax = plt.subplots(figsize=(8, 6))
+        image = ax.imshow(spec['mat'], cmap='Reds', aspect='auto', interpolation='nearest')
+        fig.colorbar(image, ax=ax)
+    elif kind == 'dendrogram':
+        from scipy.cluster.hierarchy import dendrogram, ward
+        linkageMatrix = ward(spec['mat'])
+        if timings is not None:
+            timings['ward'] = time.perf_counter() - t0
+        fig, ax = plt.subplots(figsize=(13, 10))
+        if len(spec['mat']) > spec['maxLeaves']:
+            dendrogram(linkageMatrix, orientation='top', truncate_mode='lastp', p=spec['maxLeaves'], ax=ax)
+        else:
+            dendrogram(linkageMatrix, orientation='top', ax=ax)
+    elif kind == 'stacked':
+        mat = spec['mat']
+        fig, ax = plt.subplots(figsize=(20, 8))
+        bottom = np.zeros(len(mat))
+        for j, column in enumerate(spec['columns']):
+            ax.bar(range(len(mat)), mat[:, j], bottom=bottom, label=column)
+            bottom += mat[:, j]
+        ax.set_xticks(range(len(mat)))
+        ax.set_xticklabels(spec['labels'], rotation=90)
+        ax.set_ylabel('Proportion')
+        ax.legend()
+    else:
+        raise ValueError('unknown figure kind: ' + kind)
+    ax.set_title(spec['title'])
+    fig.tight_layout()
+    tmpFile = pngFile + '.tmp.png'
+    fig.savefig(tmpFile, dpi=100)
+    plt.close(fig)
+    os.replace(tmpFile, pngFile)
+    if timings is not None:
+        timings['draw'] = time.perf_counter() - t0 - timings.get('ward', 0.0)
+    return pngFile
+
+
+def _render_timed(spec, pngFile):
+    timings = {}
+    return render_figure(spec, pngFile, timings), timings
+
+
+class ReportRenderer:
+    """Renders figure specs to outDir in a process pool, skipping figures already on disk."""
+
+    def __init__(self, outDir='figures', workers=None):
+        self.outDir = outDir
+        self.workers = workers
+        self.pool = None
+        self.futures = {}
+        self.skipped = []
+        self.timings = {}
+        os.makedirs(outDir, exist_ok=True)
+
+    def png_file(self, name, spec):
+        return os.path.join(self.outDir, name + '-' + spec_digest(spec) + '.png')
+
+    def submit(self, specs):
+        """Start rendering specs in the background; returns immediately."""
+        for name, spec in specs.items():
+            pngFile = self.png_file(name, spec)
+            if os.path.exists(pngFile):
+                self.skipped.append(pngFile)
+                continue
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            self.futures[name] = self.pool.submit(_render_timed, spec, pngFile)
+        return self
+
+    def wait(self):
+        """Block until every submitted figure is written; returns {name: pngFile} for the new ones.
+
+        The worker-side seconds of each new figure are kept in self.timings ({name: {'draw': s, ...}}).
+        """
+        rendered = {}
+        for name, future in self.futures.items():
+            rendered[name], self.timings[name] = future.result()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.futures = {}
+        return rendered
+
+
+def render_report(outputs, outDir='figures', workers=None, stopWords=frozenset(), **specArgs):
+    renderer = ReportRenderer(outDir, workers)
+    rendered = renderer.submit(figure_specs(outputs, stopWords, **specArgs)).wait()
+    return rendered, renderer.skipped
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import nltkBundle
+    import tokenKernel
+    from sensorsPipeline import run_pipeline
+    from stageCache import StageCache
+
+    parser = argparse.ArgumentParser(description='Render the analysis figures headlessly from the stage cache.')
+    parser.add_argument('outDir', nargs='?', default='figures')
+    parser.add_argument('--cache-dir', default='stageCache')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--nltk-data', default=None)
+    args = parser.parse_args()
+
+    nltkBundle.use_bundle(args.nltk_data)
+    outputs, runner = run_pipeline(targets=['sessLemmasDict', 'ngrams', 'cosine', 'nmf'],
+                                   cache=StageCache(args.cache_dir))
+    rendered, skipped = render_report(outputs, args.outDir, args.workers, tokenKernel.load_stop_words())
+    print('Figures rendered:', len(rendered), 'unchanged:', len(skipped))
+    for name, pngFile in rendered.items():
+        print(' ', pngFile)
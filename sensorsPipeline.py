@@ -0,0 +1,340 @@
+# coding: utf-8
+
+# The text analysis and topic modeling notebooks as a single cached pipeline.
+#
+# The notebooks run a fixed chain of steps:
+#
+#     progDict -> sessAbstracts -> tokens/lowers/alphaNums/nonStops -> lemmas -> BOW
+#              -> sessAbstractsDict.json -> top lemmas -> TFIDF -> cosine similarity -> NMF
+#
+# Here each step is a Stage (see stageCache.py) so that changing a downstream parameter such as
+# numOfTopics or topLemmaCount only re-runs the stages that depend on it. The tokens -> nonStops steps
+# are done in one scan by tokenKernel.normalize_abstract. The multiField* stages run the same topic
+# modeling over a weighted combination of the track, session and talk titles and the abstracts
+# (see multiField.py), reusing the abstract lemmas of the lemmas stage.
+#
+# The nearDups stage finds near-duplicate abstracts with MinHash/LSH (see nearDup.py). With collapseDups
+# set, only the first session of each cluster is kept from the BOW stages on, so reused abstracts are
+# counted once in the frequency distributions and topic models.
+#
+# nltk, numpy and sklearn (and nearDup, which needs numpy) are imported inside the stages that use them,
+# so a run whose stages all come from the cache never imports them, and NLTK data is taken from the
+# offline bundle (nltkBundle.py) rather than downloaded.
+#
+# Usage:
+#
+#     python sensorsPipeline.py --topics 7
+#     python sensorsPipeline.py --top-lemmas 300 --export sessAbstractsDict.json
+
+import argparse
+import json
+import os
+from collections import Counter
+
+import multiField
+import nltkBundle
+import tokenKernel
+from stageCache import Stage, StageCache, StageRunner
+from stageProfiler import NULL_PROFILER, StackSampler, StageProfiler, TraceProfiler
+
+# progDict.json was written on Windows and contains cp1252 characters (e.g. non-breaking spaces)
+PROG_ENCODING = 'cp1252'
+
+DEFAULT_PARAMS = {
+    'progFile': 'progDict.json',
+    'topLemmaCount': 245,
+    'numOfTopics': 5,
+    'nmfMaxIter': 500,
+    'nTerms': 10,
+    'fieldWeights': dict(multiField.DEFAULT_FIELD_WEIGHTS),
+    'dupThreshold': 0.8,
+    'dupShingle': 3,
+    'collapseDups': False,
+}
+
+
+def load_prog_dict(progFile):
+    with open(progFile, encoding=PROG_ENCODING) as f:
+        return json.loads(f.read())
+
+
+def extract_abstracts(progDict):
+    sessAbstracts = {}
+    for tID in list(progDict.keys()):
+        for sID in list(progDict[tID]['sessions'].keys()):
+            sessAbstracts[sID] = progDict[tID]['sessions'][sID]['sessAbstract']
+    return sessAbstracts
+
+
+def normalize_abstracts(sessAbstracts):
+    nltkBundle.require('stopwords')
+    stopWords = tokenKernel.load_stop_words()
+    normalized = {}
+    for sID, text in sessAbstracts.items():
+        alphaNumsList, nonStopsList = tokenKernel.normalize_abstract(text, stopWords)
+        normalized[sID] = {'sessAbstractAlphaNums': alphaNumsList, 'sessAbstractNonStops': nonStopsList}
+    return normalized
+
+
+def lemmatize_all(tokens):
+    from nltk.stem import WordNetLemmatizer
+    from nltk.tag import pos_tag
+    wnl = WordNetLemmatizer()
+    for word, tag in pos_tag(tokens):
+        if tag.startswith("NN"):
+            yield wnl.lemmatize(word, pos='n')
+        elif tag.startswith('VB'):
+            yield wnl.lemmatize(word, pos='v')
+        elif tag.startswith('JJ'):
+            yield wnl.lemmatize(word, pos='a')
+        else:
+            yield word
+
+
+def lemmatize_abstracts(normalized):
+    nltkBundle.require('averaged_perceptron_tagger', 'wordnet')
+    sessLemmas = {}
+    for sID in list(normalized.keys()):
+        lemmaStr = ' '.join(lemmatize_all(normalized[sID]['sessAbstractNonStops']))
+        sessLemmas[sID] = lemmaStr.split()
+    return sessLemmas
+
+
+def build_ngrams(normalized):
+    import nltk
+    ngrams = {}
+    for sID in list(normalized.keys()):
+        alphaNumsList = normalized[sID]['sessAbstractAlphaNums']
+        ngrams[sID] = {'sessAbstractBigrams': list(nltk.bigrams(alphaNumsList)),
+                       'sessAbstractTrigrams': list(nltk.trigrams(alphaNumsList))}
+    return ngrams
+
+
+def find_near_duplicates(normalized, dupThreshold, dupShingle):
+    import nearDup
+    docTokens = {sID: entry['sessAbstractAlphaNums'] for sID, entry in normalized.items()}
+    nearDups = nearDup.find_near_duplicates(docTokens, threshold=dupThreshold, shingle=dupShingle)
+    nearDups['sessKeys'] = list(docTokens)
+    return nearDups
+
+
+def build_lemma_bows(sessLemmas, nearDups, collapseDups):
+    # the same structure the text analysis notebook exports to sessAbstractsDict.json
+    sessLemmasDict = {}
+    for sID, lemmaList in sessLemmas.items():
+        if collapseDups and sID in nearDups['duplicateOf']:
+            continue
+        sessLemmasDict[sID] = {'sessLemmas': lemmaList, 'sessLemmaBOW': dict(Counter(lemmaList))}
+    return sessLemmasDict
+
+
+def select_top_lemmas(sessLemmasDict, topLemmaCount):
+    from nltk import FreqDist
+    totLemmas = []
+    for sID in list(sessLemmasDict.keys()):
+        totLemmas.extend(sessLemmasDict[sID]['sessLemmas'])
+    return [lemma for lemma, count in FreqDist(totLemmas).most_common(topLemmaCount)]
+
+
+def build_tfidf(sessLemmasDict, topLemmas):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    # each document keeps only the occurrences of the top lemmas, as the sessLemmaRow lists did
+    documents = []
+    for sID in list(sessLemmasDict.keys()):
+        bow = sessLemmasDict[sID]['sessLemmaBOW']
+        newDoc = []
+        for lemma in topLemmas:
+            newDoc.extend([lemma] * bow.get(lemma, 0))
+        documents.append(newDoc)
+    tfidf = TfidfVectorizer(tokenizer=lambda i: i, lowercase=False, token_pattern=None)
+    vMat = tfidf.fit_transform(documents).toarray()
+    terms = [""] * len(tfidf.vocabulary_)
+    for term, index in tfidf.vocabulary_.items():
+        terms[index] = term
+    return {'sessKeys': list(sessLemmasDict.keys()), 'vMat': vMat, 'terms': terms}
+
+
+def build_cosine(tfidfOut):
+    from sklearn.metrics.pairwise import cosine_similarity
+    return cosine_similarity(tfidfOut['vMat'])
+
+
+def build_nmf(tfidfOut, numOfTopics, nmfMaxIter, nTerms):
+    import numpy as np
+    from sklearn import decomposition
+    model = decomposition.NMF(init="nndsvd", n_components=numOfTopics, max_iter=nmfMaxIter)
+    W = model.fit_transform(tfidfOut['vMat'])
+    H = model.components_
+    rowSums = np.sum(W, axis=1, keepdims=True)
+    docTopic = np.divide(W, rowSums, out=np.zeros_like(W), where=rowSums > 0)
+    terms = tfidfOut['terms']
+    topLemmasPerTopic = {}
+    for topicIndex in range(H.shape[0]):
+        topIndices = np.argsort(H[topicIndex, :])[::-1][0:nTerms]
+        topLemmasPerTopic["T" + str(topicIndex)] = [terms[i] for i in topIndices]
+    return {'sessKeys': tfidfOut['sessKeys'], 'W': W, 'H': H, 'docTopic': docTopic,
+            'topLemmasPerTopic': topLemmasPerTopic}
+
+
+def build_multi_field_bows(progDict, sessLemmas, nearDups, collapseDups):
+    # the abstracts come already lemmatized from the lemmas stage; only the titles are lemmatized here
+    nltkBundle.require('stopwords', 'averaged_perceptron_tagger', 'wordnet')
+    skipSessions = set(nearDups['duplicateOf']) if collapseDups else ()
+    return multiField.build_field_bows(progDict, sessLemmas=sessLemmas, skipSessions=skipSessions)
+
+
+# document counts for the run report's throughput (stages without one, like topLemmas, report none)
+
+def count_prog_sessions(progDict):
+    return sum(len(progDict[tID]['sessions']) for tID in progDict)
+
+
+def count_keys(output):
+    return len(output)
+
+
+def count_sess_keys(output):
+    return len(output['sessKeys'])
+
+
+def count_field_docs(output):
+    # sessions plus talks
+    return sum(len(docKeys) for docKeys in output['docKeys'].values())
+
+
+STAGES = [
+    Stage('progDict', load_prog_dict, sourceParams=['progFile'], helpers=[PROG_ENCODING],
+          docs=count_prog_sessions),
+    Stage('sessAbstracts', extract_abstracts, deps=['progDict'], docs=count_keys),
+    Stage('normalized', normalize_abstracts, deps=['sessAbstracts'], codeModules=['tokenKernel'], docs=count_keys),
+    Stage('lemmas', lemmatize_abstracts, deps=['normalized'], helpers=[lemmatize_all], docs=count_keys),
+    Stage('ngrams', build_ngrams, deps=['normalized'], docs=count_keys),
+    Stage('nearDups', find_near_duplicates, deps=['normalized'], paramNames=['dupThreshold', 'dupShingle'],
+          codeModules=['nearDup'], docs=count_sess_keys),
+    Stage('sessLemmasDict', build_lemma_bows, deps=['lemmas', 'nearDups'], paramNames=['collapseDups'], version=2,
+          docs=count_keys),
+    Stage('topLemmas', select_top_lemmas, deps=['sessLemmasDict'], paramNames=['topLemmaCount']),
+    Stage('tfidf', build_tfidf, deps=['sessLemmasDict', 'topLemmas'], docs=count_sess_keys),
+    Stage('cosine', build_cosine, deps=['tfidf'], docs=count_keys),
+    Stage('nmf', build_nmf, deps=['tfidf'], paramNames=['numOfTopics', 'nmfMaxIter', 'nTerms'], version=2,
+          docs=count_sess_keys),
+    Stage('multiFieldBOW', build_multi_field_bows, deps=['progDict', 'lemmas', 'nearDups'],
+          paramNames=['collapseDups'], codeModules=['multiField', 'tokenKernel'], docs=count_field_docs),
+    Stage('multiFieldMatrix', multiField.weighted_matrices, deps=['multiFieldBOW'], paramNames=['fieldWeights'],
+          helpers=[multiField.DEFAULT_FIELD_WEIGHTS], docs=count_field_docs),
+    Stage('multiFieldTfidf', multiField.weighted_tfidf, deps=['multiFieldMatrix'], paramNames=['topLemmaCount'],
+          docs=count_sess_keys),
+    Stage('multiFieldNmf', build_nmf, deps=['multiFieldTfidf'], paramNames=['numOfTopics', 'nmfMaxIter', 'nTerms'],
+          docs=count_sess_keys),
+]
+
+
+def export_sess_lemmas(sessLemmasDict, jsonFile):
+    jsonStr = json.dumps(sessLemmasDict, sort_keys=False, indent=2, separators=(',', ': '), ensure_ascii=False)
+    with open(jsonFile, 'w', encoding='utf-8') as f:
+        f.write(jsonStr)
+
+
+def run_pipeline(params=None, targets=None, cache=None, exportFile=None, profiler=NULL_PROFILER, progDict=None):
+    """Run (or load from the stage cache) the stages needed for targets and return their outputs.
+
+    progDict, when given, is used in place of reading params['progFile'] (see progExtractor.py).
+    """
+    runParams = dict(DEFAULT_PARAMS)
+    runParams.update(params or {})
+    runner = StageRunner(STAGES, cache if cache is not None else StageCache(), profiler)
+    if exportFile is not None and targets is not None and 'sessLemmasDict' not in targets:
+        targets = list(targets) + ['sessLemmasDict']
+    outputs = runner.run(runParams, targets, seeds={'progDict': progDict} if progDict is not None else None)
+    if exportFile is not None:
+        export_sess_lemmas(outputs['sessLemmasDict'], exportFile)
+    return outputs, runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cached text analysis and topic modeling of the conference program.')
+    parser.add_argument('--prog-file', default=DEFAULT_PARAMS['progFile'])
+    parser.add_argument('--top-lemmas', type=int, default=DEFAULT_PARAMS['topLemmaCount'])
+    parser.add_argument('--topics', type=int, default=DEFAULT_PARAMS['numOfTopics'])
+    parser.add_argument('--terms', type=int, default=DEFAULT_PARAMS['nTerms'])
+    parser.add_argument('--field-weight', action='append', default=[], metavar='FIELD=WEIGHT',
+                        help='weight of a text field in the multi-field matrix, e.g. sessTitle=3 (repeatable)')
+    parser.add_argument('--collapse-dups', action='store_true', help='keep one session per near-duplicate cluster')
+    parser.add_argument('--dup-threshold', type=float, default=DEFAULT_PARAMS['dupThreshold'])
+    parser.add_argument('--export', default=None, help='write sessAbstractsDict.json to this path')
+    parser.add_argument('--cache-dir', default='stageCache')
+    parser.add_argument('--max-cache-mb', type=int, default=512)
+    parser.add_argument('--nltk-data', default=None, help='offline NLTK bundle (default $SENSORS_NLTK_DATA or ./nltk_data)')
+    parser.add_argument('--profile', action='store_true', help='write a per-stage run report to --report-dir')
+    parser.add_argument('--report-dir', default='runReports')
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument('--sample', action='store_true',
+                          help='also stack-sample every executed stage (implies --profile)')
+    sampling.add_argument('--trace', action='store_true',
+                          help='also trace every executed stage with cProfile: exact call counts, but slows '
+                               'call-heavy stages (implies --profile)')
+    parser.add_argument('--memory', action='store_true', help='track peak allocations with tracemalloc (slow)')
+    parser.add_argument('--figures', default=None, help='render the report figures headlessly into this directory')
+    parser.add_argument('--figure-workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    nltkBundle.use_bundle(args.nltk_data)
+
+    fieldWeights = dict(DEFAULT_PARAMS['fieldWeights'])
+    for fieldWeight in args.field_weight:
+        field, weight = fieldWeight.split('=')
+        if field not in fieldWeights:
+            parser.error('unknown field ' + field + ', expected one of ' + ', '.join(fieldWeights))
+        fieldWeights[field] = float(weight)
+    params = {'progFile': args.prog_file, 'topLemmaCount': args.top_lemmas,
+              'numOfTopics': args.topics, 'nTerms': args.terms, 'fieldWeights': fieldWeights,
+              'dupThreshold': args.dup_threshold, 'collapseDups': args.collapse_dups}
+    cache = StageCache(args.cache_dir, maxBytes=args.max_cache_mb * 1024 * 1024)
+    profiler = NULL_PROFILER
+    if args.profile or args.sample or args.trace:
+        sampleDir = os.path.join(args.report_dir, 'samples') if args.sample or args.trace else None
+        profiler = StageProfiler(trackMemory=args.memory, sampleDir=sampleDir,
+                                 sampler=TraceProfiler if args.trace else StackSampler)
+    outputs, runner = run_pipeline(params, cache=cache, exportFile=args.export, profiler=profiler)
+
+    renderer = None
+    if args.figures:
+        # rendering runs in worker processes while the results are reported below
+        from reportRenderer import ReportRenderer, figure_specs
+        renderer = ReportRenderer(args.figures, args.figure_workers)
+        with profiler.stage('figureSpecs'):
+            specs = figure_specs(outputs, tokenKernel.load_stop_words())
+        renderer.submit(specs)
+
+    print('Stages executed:', runner.executed)
+    print('Stages loaded from cache:', runner.loaded)
+    print('')
+    print('Near-duplicate abstract clusters:', outputs['nearDups']['clusters'])
+    print('')
+    print('Topics from the session abstracts:')
+    for topic, lemmas in outputs['nmf']['topLemmasPerTopic'].items():
+        print(topic, lemmas)
+    print('')
+    print('Topics from titles and abstracts combined:')
+    for topic, lemmas in outputs['multiFieldNmf']['topLemmasPerTopic'].items():
+        print(topic, lemmas)
+
+    if renderer is not None:
+        with profiler.stage('figureWait'):
+            rendered = renderer.wait()
+        # the worker-side time of each figure, with ward clustering split out of the dendrogram
+        for name, timings in renderer.timings.items():
+            for part, seconds in timings.items():
+                profiler.add_timing('figure:' + name if part == 'draw' else part + ':' + name, seconds)
+        print('')
+        print('Figures rendered:', len(rendered), 'unchanged:', len(renderer.skipped), 'in', args.figures)
+
+    if profiler.enabled:
+        reportFile = profiler.write_report(args.report_dir, params)
+        print('')
+        print(profiler.summary())
+        print('Run report:', reportFile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# coding: utf-8
+
+# Content-addressed cache for the stages of the analysis pipeline.
+#
+# Every stage is identified by a key computed from its name, its version, the parameters it reads,
+# the content of any source files it reads, its code and the keys of the stages it depends on. Because
+# the key of a stage folds in the keys of its inputs, changing a parameter (say numOfTopics) only changes
+# the keys of the stages that read it and of the stages downstream of them -- everything upstream is
+# loaded from disk instead of being recomputed. The code of a stage is the source of its function, of
+# the helpers it names (functions or constants from the same module, e.g. lemmatize_all) and the source
+# files of the helper modules it names in codeModules. Editing e.g. tokenKernel.TOKEN_PATTERN therefore
+# invalidates the tokenizing stages without anyone having to remember to bump a version, while editing
+# unrelated code next to a stage function (say the CLI in sensorsPipeline.py) invalidates nothing.
+#
+# Outputs are pickled into cacheDir, one file per key. The directory is kept under maxBytes by
+# evicting the least recently used entries (the modification time of an entry is refreshed on every hit).
+
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+from collections import OrderedDict
+
+from stageProfiler import NULL_PROFILER
+
+
+class Stage:
+    """One node of the pipeline DAG.
+
+    func is called as func(*depOutputs, **params) where depOutputs are the outputs of the stages named
+    in deps (in order) and params holds only the parameters named in paramNames. sourceParams names
+    parameters holding file paths whose content, not just their name, is part of the key. The source
+    of func, of the functions in helpers (constants in helpers count by their repr) and the source
+    files of the modules named in codeModules are part of the key as well; bump version only for changes
+    outside them (such as a library upgrade) that change the output.
+
+    docs, when given, is called with the output and returns the number of documents in it, for the
+    throughput in run reports.
+    """
+
+    def __init__(self, name, func, deps=(), paramNames=(), sourceParams=(), helpers=(), codeModules=(),
+                 version=1, docs=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.paramNames = tuple(paramNames)
+        self.sourceParams = tuple(sourceParams)
+        self.helpers = tuple(helpers)
+        self.codeModules = tuple(codeModules)
+        self.version = version
+        self.docs = docs
+
+    def code_sources(self):
+        """Source text of func and of the helpers that is part of the stage key."""
+        return [inspect.getsource(obj) if callable(obj) else repr(obj) for obj in (self.func,) + self.helpers]
+
+    def code_files(self):
+        """Source files of the codeModules (found without importing the modules)."""
+        return [importlib.util.find_spec(moduleName).origin for moduleName in self.codeModules]
+
+
+def file_digest(path):
+    """sha256 of the content of path."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class StageCache:
+    """Pickled stage outputs stored under cacheDir, bounded to maxBytes with LRU eviction."""
+
+    def __init__(self, cacheDir='stageCache', maxBytes=512 * 1024 * 1024):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key + '.pkl')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self._path(key)
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+        os.utime(path)
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, path)
+        self.evict(keep=key)
+
+    def entries(self):
+        """(mtime, size, path) for every cached output, oldest first."""
+        entries = []
+        for fileName in os.listdir(self.cacheDir):
+            if fileName.endswith('.pkl'):
+                st = os.stat(os.path.join(self.cacheDir, fileName))
+                entries.append((st.st_mtime, st.st_size, os.path.join(self.cacheDir, fileName)))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in maxBytes.
+
+        The entry for keep (normally the one just written) is never evicted, even if it alone is
+        larger than maxBytes.
+        """
+        entries = self.entries()
+        totBytes = sum(size for mtime, size, path in entries)
+        keepPath = self._path(keep) if keep is not None else None
+        for mtime, size, path in entries:
+            if totBytes <= self.maxBytes:
+                break
+            if path != keepPath:
+                os.remove(path)
+                totBytes -= size
+        return totBytes
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            os.remove(path)
+
+
+class StageRunner:
+    """Runs the stages needed for a set of targets, re-executing only the invalidated ones.
+
+    Every load or execution is wrapped in profiler.stage() (see stageProfiler.py).
+    """
+
+    def __init__(self, stages, cache, profiler=NULL_PROFILER):
+        self.stages = OrderedDict((stage.name, stage) for stage in stages)
+        self.cache = cache
+        self.profiler = profiler
+        self.executed = []
+        self.loaded = []
+
+    def stage_keys(self, params, seeds=None):
+        """Key of every stage for params, computed without loading or running anything.
+
+        A seeded stage (one whose output is supplied in seeds) is keyed by the content of that output.
+        """
+        seeds = seeds or {}
+        keys = {}
+        codeDigests = {}
+
+        def code_digest(path):
+            if path not in codeDigests:
+                codeDigests[path] = file_digest(path)
+            return codeDigests[path]
+
+        for name, stage in self.stages.items():
+            if name in seeds:
+                seedStr = json.dumps(seeds[name], sort_keys=True, default=str)
+                keys[name] = name + '-' + hashlib.sha256(seedStr.encode('utf-8')).hexdigest()[:24]
+                continue
+            keyParts = {
+                'stage': name,
+                'version': stage.version,
+                'params': {p: params[p] for p in stage.paramNames},
+                'sources': {p: file_digest(params[p]) for p in stage.sourceParams},
+                'code': [hashlib.sha256(src.encode('utf-8')).hexdigest() for src in stage.code_sources()],
+                'codeModules': [code_digest(path) for path in stage.code_files()],
+                'deps': [keys[dep] for dep in stage.deps],
+            }
+            keyStr = json.dumps(keyParts, sort_keys=True, default=str)
+            keys[name] = name + '-' + hashlib.sha256(keyStr.encode('utf-8')).hexdigest()[:24]
+        return keys
+
+    def run(self, params, targets=None, seeds=None):
+        """Return a dictionary of outputs for targets (all stages when targets is None).
+
+        An upstream stage is only loaded or executed if some invalidated stage actually needs it.
+        seeds maps stage names to outputs produced elsewhere (e.g. a progDict extracted in memory);
+        those stages are neither run nor stored.
+        """
+        keys = self.stage_keys(params, seeds)
+        targets = list(self.stages.keys()) if targets is None else list(targets)
+        self.executed = []
+        self.loaded = []
+        outputs = dict(seeds or {})
+
+        def resolve(name):
+            if name in outputs:
+                return outputs[name]
+            key = keys[name]
+            stage = self.stages[name]
+            if key in self.cache:
+                with self.profiler.stage(name, cached=True):
+                    outputs[name] = self.cache.get(key)
+                self.loaded.append(name)
+            else:
+                depOutputs = [resolve(dep) for dep in stage.deps]
+                stageParams = {p: params[p] for p in stage.paramNames + stage.sourceParams}
+                with self.profiler.stage(name):
+                    outputs[name] = stage.func(*depOutputs, **stageParams)
+                self.cache.put(key, outputs[name])
+                self.executed.append(name)
+            if self.profiler.enabled:
+                self.profiler.set_docs(name, stage.docs(outputs[name]) if stage.docs is not None else None)
+            return outputs[name]
+
+        return {name: resolve(name) for name in targets}
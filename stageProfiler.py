@@ -0,0 +1,298 @@
+# coding: utf-8
+
+# Per-stage instrumentation for the analysis pipeline.
+#
+# A StageProfiler wraps each stage the StageRunner loads or executes and records, per stage:
+#
+#     calls          number of times the stage ran (or was loaded) in this run
+#     seconds        wall time
+#     peakRssBytes   process resident set high-water mark after the stage (where the OS reports it)
+#     peakMemBytes   peak Python memory allocated while the stage ran (tracemalloc, only with trackMemory
+#                    since tracing every allocation slows allocation-heavy stages many times over)
+#     docs           number of documents (sessions, talks) the stage produced, None for stages such as
+#                    topLemmas whose output is not a set of documents
+#     docsPerSecond  document throughput
+#     cached         whether the output came from the stage cache
+#
+# Optionally each executed stage is also run under a sampler hook: any object with start() and stop()
+# that can list its top_functions() and dump() its raw data next to the report. Two are provided:
+#
+#     StackSampler    statistical: a background thread records the stage thread's stack every few
+#                     milliseconds, so the stage runs at (nearly) full speed and hot loops such as
+#                     lemmatize_all or pos_tag are timed as they really run
+#     TraceProfiler   deterministic tracing with cProfile: exact call counts, but every Python call is
+#                     hooked, which inflates the time of call-heavy loops many times over
+#
+# Work done outside the StageRunner (figure specs, ward clustering and drawing in the renderer's worker
+# processes) is added with add_timing(). At the end of a run write_report() stores a JSON report and a
+# short text summary; compare_reports() checks a report against a baseline for the nightly job.
+#
+# Profiling off means the runner gets NULL_PROFILER, whose stage() hands back one shared no-op
+# context manager, so the only cost is a method call per stage.
+
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+NULL_CONTEXT = contextlib.nullcontext()
+
+
+class NullProfiler:
+    enabled = False
+
+    def stage(self, name, cached=False):
+        return NULL_CONTEXT
+
+    def set_docs(self, name, docs):
+        pass
+
+    def add_timing(self, name, seconds, docs=None):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class StageRecord:
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.peakMemBytes = 0
+        self.peakRssBytes = 0
+        self.docs = None
+        self.cached = False
+        self.topFunctions = []
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'seconds': round(self.seconds, 6),
+            'peakMemBytes': self.peakMemBytes,
+            'peakRssBytes': self.peakRssBytes,
+            'docs': self.docs,
+            'docsPerSecond': round(self.docs / self.seconds, 1) if self.docs and self.seconds > 0 else None,
+            'cached': self.cached,
+            'topFunctions': self.topFunctions,
+        }
+
+
+def _frame_label(code):
+    return os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + '(' + code.co_name + ')'
+
+
+class StackSampler:
+    """Statistical profiler: a background thread samples the stack of the thread that called start()."""
+
+    suffix = '.folded'
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self, threadID):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(threadID)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, args=(threading.get_ident(),), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._t0
+
+    def top_functions(self, n):
+        """Functions by the share of samples they were on the stack (cum) or on top of it (self)."""
+        cum, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            for label in set(stack):
+                cum[label] += count
+            own[stack[-1]] += count
+        perSample = self.seconds / self.samples if self.samples else 0.0
+        return [{'function': label, 'samples': count, 'selfSamples': own[label],
+                 'cumSeconds': round(count * perSample, 6)} for label, count in cum.most_common(n)]
+
+    def dump(self, path):
+        """Write the samples as folded stacks ('outer;inner count' lines, the flame graph input format)."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(';'.join(stack) + ' ' + str(count) + '\n')
+
+
+class TraceProfiler:
+    """Deterministic tracing with cProfile -- exact call counts, but distorted timings in hot loops."""
+
+    suffix = '.prof'
+
+    def start(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def top_functions(self, n):
+        import pstats
+        rows = []
+        for (fileName, lineNo, funcName), (cc, nc, tt, ct, callers) in pstats.Stats(self.profile).stats.items():
+            rows.append((ct, nc, os.path.basename(fileName) + ':' + str(lineNo) + '(' + funcName + ')'))
+        rows.sort(reverse=True)
+        return [{'function': func, 'calls': nc, 'cumSeconds': round(ct, 6)} for ct, nc, func in rows[0:n]]
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+class StageProfiler:
+    """Collects per-stage timings, memory and throughput; optionally samples executed stages.
+
+    sampler is a factory (such as StackSampler or TraceProfiler) called once per executed stage when
+    sampleDir is set.
+    """
+
+    enabled = True
+
+    def __init__(self, trackMemory=False, sampleDir=None, topFunctions=10, sampler=StackSampler):
+        self.trackMemory = trackMemory
+        self.sampleDir = sampleDir
+        self.topFunctions = topFunctions
+        self.sampler = sampler
+        self.records = {}
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.startTime = time.perf_counter()
+        if sampleDir:
+            os.makedirs(sampleDir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def stage(self, name, cached=False):
+        record = self.records.setdefault(name, StageRecord())
+        record.calls += 1
+        record.cached = cached
+        startedTracing = False
+        if self.trackMemory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                startedTracing = True
+            tracemalloc.reset_peak()
+        sampler = None
+        if self.sampleDir and not cached:
+            sampler = self.sampler()
+            sampler.start()
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds += time.perf_counter() - t0
+            if sampler is not None:
+                sampler.stop()
+                sampler.dump(os.path.join(self.sampleDir, name + sampler.suffix))
+                record.topFunctions = sampler.top_functions(self.topFunctions)
+            if resource is not None:
+                # ru_maxrss is in kilobytes on Linux
+                record.peakRssBytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            if self.trackMemory:
+                record.peakMemBytes = max(record.peakMemBytes, tracemalloc.get_traced_memory()[1])
+                if startedTracing:
+                    tracemalloc.stop()
+
+    def set_docs(self, name, docs):
+        self.records.setdefault(name, StageRecord()).docs = docs
+
+    def add_timing(self, name, seconds, docs=None):
+        """Record work timed elsewhere (e.g. in a worker process) as one call of name."""
+        record = self.records.setdefault(name, StageRecord())
+        record.calls += 1
+        record.seconds += seconds
+        if docs is not None:
+            record.docs = (record.docs or 0) + docs
+
+    def report(self, params=None):
+        return {
+            'started': self.started,
+            'wallSeconds': round(time.perf_counter() - self.startTime, 6),
+            'params': params or {},
+            'stages': {name: record.as_dict() for name, record in self.records.items()},
+        }
+
+    def summary(self, report=None):
+        report = report or self.report()
+        lines = ['Run started ' + report['started'] + ', wall time ' + str(round(report['wallSeconds'], 2)) + 's',
+                 '%-28s %6s %10s %10s %10s %8s %10s' % ('stage', 'calls', 'seconds', 'alloc MB', 'rss MB',
+                                                         'docs', 'docs/s')]
+        for name, rec in report['stages'].items():
+            lines.append('%-28s %6d %10.3f %10.1f %10.1f %8s %10s' % (
+                name + (' *' if rec['cached'] else ''), rec['calls'], rec['seconds'],
+                rec['peakMemBytes'] / 2 ** 20, rec['peakRssBytes'] / 2 ** 20,
+                rec['docs'] if rec['docs'] is not None else '-',
+                rec['docsPerSecond'] if rec['docsPerSecond'] is not None else '-'))
+        lines.append('(* loaded from the stage cache)')
+        return '\n'.join(lines)
+
+    def write_report(self, reportDir='runReports', params=None):
+        """Write <timestamp>.json and <timestamp>.txt to reportDir and return the JSON path."""
+        os.makedirs(reportDir, exist_ok=True)
+        report = self.report(params)
+        baseName = os.path.join(reportDir, report['started'].replace(':', '-'))
+        with open(baseName + '.json', 'w') as f:
+            f.write(json.dumps(report, indent=2, default=str))
+        with open(baseName + '.txt', 'w') as f:
+            f.write(self.summary(report) + '\n')
+        return baseName + '.json'
+
+
+def compare_reports(current, baseline, tolerance=0.25, minSeconds=0.05):
+    """Stages of current that are more than tolerance slower than in baseline.
+
+    Both arguments are report dictionaries (or paths to report JSON files). Stages that were loaded
+    from the cache in either run, or that take less than minSeconds, are not compared.
+    """
+    if isinstance(current, str):
+        with open(current) as f:
+            current = json.loads(f.read())
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.loads(f.read())
+    regressions = []
+    for name, rec in current['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None or rec['cached'] or base['cached'] or base['seconds'] < minSeconds:
+            continue
+        if rec['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append({'stage': name, 'seconds': rec['seconds'], 'baselineSeconds': base['seconds'],
+                                'ratio': round(rec['seconds'] / base['seconds'], 2)})
+    return regressions
+
+
+if __name__ == '__main__':
+    import sys
+
+    # python stageProfiler.py current.json baseline.json -- exit status 1 if any stage regressed
+    regressions = compare_reports(sys.argv[1], sys.argv[2])
+    for reg in regressions:
+        print('REGRESSION', reg['stage'], reg['baselineSeconds'], '->', reg['seconds'], 'x' + str(reg['ratio']))
+    sys.exit(1 if regressions else 0)
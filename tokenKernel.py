@@ -0,0 +1,109 @@
+# coding: utf-8
+
+# Fused tokenize-and-normalize kernel for the session abstracts.
+#
+# The text analysis notebook builds the cleaned token lists in four passes per abstract:
+#
+#     tokens    = TreebankWordTokenizer().tokenize(abstract)
+#     lowers    = [w.lower() for w in tokens]
+#     alphaNums = [re.sub(r"[^a-zA-Z0-9\-]","", w) for w in lowers]      (minus '-', '--', ' ', '')
+#     nonStops  = [w for w in alphaNums if not w in stop_words and len(w) > 1]
+#
+# This module collapses that chain into a single precompiled regular expression applied to the
+# lower-cased abstract. A token is a run of ASCII letters/digits/hyphens, optionally glued together by
+# "joiner" characters that Treebank leaves inside a word (e.g.  i/o, e.g., 4.0, wi-fi). The joiners are
+# then dropped with one str.translate call, which is what the per-token re.sub did. Treebank also keeps
+# non-ASCII punctuation (curly apostrophes, em-dashes) inside a word, so any non-ASCII character other
+# than whitespace is a joiner as well; the few tokens that contain one are cleaned with a second pattern.
+# The result is the sessAbstractAlphaNums list; the stopword/length filter produces sessAbstractNonStops.
+#
+# The two approaches are not identical in every corner (contractions such as "don't" and runs of
+# non-ASCII letters are the usual suspects), so conformance_report() runs both and lists the
+# token-level differences for each abstract.
+
+import re
+from collections import Counter
+
+# a word is one or more [a-z0-9] runs separated by single hyphens or by joiner characters;
+# runs of two or more hyphens ('--') separate words, just as Treebank splits them off, so a leading
+# or trailing hyphen is only kept when it is not part of such a run
+TOKEN_PATTERN = re.compile(r"(?:(?<!-)-)?[a-z0-9]+(?:(?:-|(?:[./_+@#%*=~^|`\\]|[^\x00-\x7f\s])+)[a-z0-9]+)*(?:-(?!-))?")
+
+# characters the notebook's re.sub would have removed from inside a token
+JOINER_TABLE = str.maketrans('', '', "./_+@#%*=~^|`\\")
+NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def load_stop_words():
+    """Return the NLTK English stopword list as a frozenset."""
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+def alphanum_tokens(text):
+    """Lower-cased alphanumeric tokens for text -- the equivalent of sessAbstractAlphaNums."""
+    tokens = [w.translate(JOINER_TABLE) for w in TOKEN_PATTERN.findall(text.lower())]
+    return [w if w.isascii() else NON_ASCII.sub('', w) for w in tokens]
+
+
+def nonstop_tokens(text, stopWords):
+    """Alphanumeric tokens with stopwords and single characters removed -- sessAbstractNonStops."""
+    return [w for w in alphanum_tokens(text) if len(w) > 1 and w not in stopWords]
+
+
+def normalize_abstract(text, stopWords):
+    """Single scan of text returning (alphaNums, nonStops).
+
+    The bigram/trigram stage works from the alphaNums list while the lemma stage works from the
+    nonStops, so both are produced from the same findall.
+    """
+    alphaNumsList = alphanum_tokens(text)
+    nonStopsList = [w for w in alphaNumsList if len(w) > 1 and w not in stopWords]
+    return alphaNumsList, nonStopsList
+
+
+def treebank_chain(text, stopWords):
+    """The notebook's original Treebank + re.sub chain, kept as the conformance reference."""
+    from nltk.tokenize import TreebankWordTokenizer
+    lowerCaseList = [w.lower() for w in TreebankWordTokenizer().tokenize(text)]
+    alphaNumsList = [re.sub(r"[^a-zA-Z0-9\-]", "", word) for word in lowerCaseList]
+    alphaNumsList = [w for w in alphaNumsList if not w in ['-', '--', ' ', '']]
+    nonStopsList = [w for w in alphaNumsList if not w in stopWords]
+    nonStopsList = [w for w in nonStopsList if len(w) > 1]
+    return alphaNumsList, nonStopsList
+
+
+def conformance_report(sessAbstractsDict, stopWords, field='sessAbstract'):
+    """Compare the fused kernel with the Treebank chain for every abstract.
+
+    Returns a dictionary keyed by session ID holding only the sessions that differ. Each entry lists
+    the non-stop tokens the kernel is 'missing' (produced only by Treebank) and the 'extra' ones it
+    produced instead, with their counts.
+    """
+    diffs = {}
+    for sID in list(sessAbstractsDict.keys()):
+        text = sessAbstractsDict[sID][field]
+        kernelTokens = Counter(nonstop_tokens(text, stopWords))
+        treebankTokens = Counter(treebank_chain(text, stopWords)[1])
+        if kernelTokens != treebankTokens:
+            diffs[sID] = {'missing': dict(treebankTokens - kernelTokens),
+                          'extra': dict(kernelTokens - treebankTokens)}
+    return diffs
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+
+    # python tokenKernel.py [progDict.json] -- prints the conformance differences for every abstract
+    progFile = sys.argv[1] if len(sys.argv) > 1 else 'progDict.json'
+    with open(progFile, encoding='cp1252') as f:
+        progDict = json.loads(f.read())
+    sessAbstractsDict = {}
+    for tID in list(progDict.keys()):
+        for sID in list(progDict[tID]['sessions'].keys()):
+            sessAbstractsDict[sID] = {'sessAbstract': progDict[tID]['sessions'][sID]['sessAbstract']}
+    diffs = conformance_report(sessAbstractsDict, load_stop_words())
+    print('Abstracts:', len(sessAbstractsDict), 'Abstracts with token differences:', len(diffs))
+    for sID, diff in diffs.items():
+        print(sID, 'missing:', diff['missing'], 'extra:', diff['extra'])
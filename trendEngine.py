@@ -0,0 +1,273 @@
+# coding: utf-8
+
+# Cross-year trends in the conference programs.
+#
+# The text analysis notebook answers questions such as how pervasive 'iot', 'machine learning' or 'edge'
+# are for one year. This module keeps per-year counts so the same questions can be asked over time.
+#
+# The store is a directory holding
+#
+#     vocab.json      the shared, append-only list of terms (lemmas, and n-grams joined by spaces)
+#     years.json      for every year: its track IDs and titles and the number of sessions per track
+#     <year>.npz      a track x term sparse count matrix for that year
+#
+# Adding a year counts only that year's program; earlier matrices are left as they are and simply read
+# with extra (zero) columns for terms that entered the vocabulary later. Queries stack the years into a
+# years x terms array and are answered with array operations over all terms at once: rising/falling
+# terms by least-squares slope of their share, per-track share of a term, a two-proportion z-test between
+# two years and a chi-square test of homogeneity across all years.
+#
+# Lemmas, bigrams and trigrams overlap (every word of a trigram is also counted as a lemma and in two
+# bigrams), so they are not draws from one population. The share of a term is therefore taken over the
+# terms of its own order only -- a bigram's share is its count over all bigram counts of the year --
+# and the tests compare each term against the total of its order.
+#
+# Usage:
+#
+#     python trendEngine.py add 2018 progDict.json
+#     python trendEngine.py trend iot "machine learning" edge
+#     python trendEngine.py rising --top 20
+#     python trendEngine.py tracks iot
+#     python trendEngine.py compare 2018 2019
+#     python trendEngine.py changed
+
+import json
+import os
+from collections import Counter
+
+import numpy as np
+from scipy import sparse, special, stats
+
+
+def year_counts(sessLemmasDict, ngrams=None, stopWords=frozenset()):
+    """Per-track Counters of lemmas plus (when ngrams is given) bigrams and trigrams.
+
+    n-grams are kept only when neither end is a stopword, as in the notebook's bigram/trigram analysis.
+    """
+    trkCounts = {}
+    for sID, entry in sessLemmasDict.items():
+        counts = trkCounts.setdefault(sID[-3:], Counter())
+        counts.update(entry['sessLemmaBOW'])
+        if ngrams is not None:
+            for gramKey in ('sessAbstractBigrams', 'sessAbstractTrigrams'):
+                counts.update(' '.join(gram) for gram in ngrams[sID][gramKey]
+                              if gram[0] not in stopWords and gram[-1] not in stopWords)
+    return trkCounts
+
+
+class TrendStore:
+
+    def __init__(self, storeDir='trendStore'):
+        self.storeDir = storeDir
+        os.makedirs(storeDir, exist_ok=True)
+        self.vocab = self._read_json('vocab.json', [])
+        self.termIndex = {term: i for i, term in enumerate(self.vocab)}
+        self.years = self._read_json('years.json', {})
+        self._stacked = None
+
+    def _read_json(self, fileName, default):
+        path = os.path.join(self.storeDir, fileName)
+        if not os.path.exists(path):
+            return default
+        with open(path, encoding='utf-8') as f:
+            return json.loads(f.read())
+
+    def _write_json(self, fileName, value):
+        path = os.path.join(self.storeDir, fileName)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps(value, ensure_ascii=False))
+        os.replace(path + '.tmp', path)
+
+    def add_year(self, year, trkCounts, trkTitles=None, trkSessions=None):
+        """Store (or replace) one year's track x term counts without touching the other years."""
+        year = str(year)
+        trkIDs = sorted(trkCounts)
+        rows, cols, vals = [], [], []
+        for row, trkID in enumerate(trkIDs):
+            for term, count in trkCounts[trkID].items():
+                if term not in self.termIndex:
+                    self.termIndex[term] = len(self.vocab)
+                    self.vocab.append(term)
+                rows.append(row)
+                cols.append(self.termIndex[term])
+                vals.append(count)
+        mat = sparse.csr_matrix((vals, (rows, cols)), shape=(len(trkIDs), len(self.vocab)), dtype=np.int32)
+        sparse.save_npz(os.path.join(self.storeDir, year + '.npz'), mat)
+        self.years[year] = {'tracks': trkIDs,
+                            'trkTitles': [(trkTitles or {}).get(t, '') for t in trkIDs],
+                            'sessions': [(trkSessions or {}).get(t, 0) for t in trkIDs]}
+        self._write_json('vocab.json', self.vocab)
+        self._write_json('years.json', self.years)
+        self._stacked = None
+
+    def add_program(self, year, progDict, sessLemmasDict, ngrams=None, stopWords=frozenset()):
+        trkTitles = {tID: progDict[tID]['trkTitle'] for tID in progDict}
+        trkSessions = {tID: len(progDict[tID]['sessions']) for tID in progDict}
+        self.add_year(year, year_counts(sessLemmasDict, ngrams, stopWords), trkTitles, trkSessions)
+
+    def year_list(self):
+        return sorted(self.years)
+
+    def track_matrix(self, year):
+        """The stored track x term matrix for year, widened to the current vocabulary."""
+        mat = sparse.load_npz(os.path.join(self.storeDir, str(year) + '.npz'))
+        if mat.shape[1] < len(self.vocab):
+            mat.resize((mat.shape[0], len(self.vocab)))
+        return mat
+
+    def term_orders(self):
+        """Number of words in every vocabulary term: 1 for lemmas, 2 for bigrams, 3 for trigrams."""
+        return np.array([term.count(' ') + 1 for term in self.vocab], dtype=np.int64)
+
+    def order_totals(self, mat):
+        """For a rows x terms count matrix, the total of each term's order per row (rows x terms)."""
+        orders = self.term_orders()
+        byOrder = np.zeros((len(orders), orders.max() if len(orders) else 1))
+        byOrder[np.arange(len(orders)), orders - 1] = 1.0
+        return np.asarray(mat @ byOrder)[:, orders - 1]
+
+    def stacked(self):
+        """(years, counts, totals): years x terms arrays of the term counts and of the total count per
+        year of the terms of the same order as each term."""
+        if self._stacked is None:
+            years = self.year_list()
+            counts = np.vstack([np.asarray(self.track_matrix(year).sum(axis=0)).ravel() for year in years])
+            counts = counts.astype(np.float64)
+            self._stacked = (years, counts, self.order_totals(counts))
+        return self._stacked
+
+    def shares(self):
+        years, counts, totals = self.stacked()
+        return years, np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+    def term_ids(self, terms):
+        missing = [term for term in terms if term not in self.termIndex]
+        if missing:
+            raise KeyError('terms not in any stored year: ' + ', '.join(missing))
+        return [self.termIndex[term] for term in terms]
+
+    def trend(self, terms):
+        """{term: [share per year]} for the given terms."""
+        years, share = self.shares()
+        ids = self.term_ids(terms)
+        return years, {term: share[:, i].tolist() for term, i in zip(terms, ids)}
+
+    def slopes(self):
+        """Least-squares slope of every term's share over the year index."""
+        years, share = self.shares()
+        x = np.arange(len(years), dtype=np.float64)
+        x -= x.mean()
+        return (x[:, None] * (share - share.mean(axis=0))).sum(axis=0) / (x ** 2).sum()
+
+    def moving_terms(self, top=20, minCount=5, falling=False):
+        """The top terms with the largest rising (or falling) share slope and at least minCount uses."""
+        years, counts, totals = self.stacked()
+        if len(years) < 2:
+            return []
+        slope = self.slopes()
+        slope[counts.sum(axis=0) < minCount] = 0.0
+        order = np.argsort(slope if falling else -slope)[0:top]
+        return [(self.vocab[i], float(slope[i])) for i in order if (slope[i] < 0 if falling else slope[i] > 0)]
+
+    def track_share(self, term):
+        """For every year, each track's share of its own count of terms of term's order that goes to term."""
+        termID = self.term_ids([term])[0]
+        result = {}
+        for year in self.year_list():
+            mat = self.track_matrix(year)
+            trkTotals = self.order_totals(mat)[:, termID]
+            termCounts = mat[:, termID].toarray().ravel()
+            share = np.divide(termCounts, trkTotals, out=np.zeros(len(trkTotals)), where=trkTotals > 0)
+            result[year] = {trkID: (title, float(s)) for trkID, title, s in
+                            zip(self.years[year]['tracks'], self.years[year]['trkTitles'], share)}
+        return result
+
+    def compare_years(self, year1, year2, top=20, minCount=5):
+        """Two-proportion z-test of every term's share between two years, most significant first."""
+        years, counts, totals = self.stacked()
+        i, j = years.index(str(year1)), years.index(str(year2))
+        c1, c2, n1, n2 = counts[i], counts[j], totals[i], totals[j]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pooled = (c1 + c2) / (n1 + n2)
+            se = np.sqrt(pooled * (1 - pooled) * (1 / n1 + 1 / n2))
+            z = np.divide(c2 / n2 - c1 / n1, se, out=np.zeros_like(se), where=se > 0)
+        pValue = special.erfc(np.abs(z) / np.sqrt(2))
+        keep = np.flatnonzero(c1 + c2 >= minCount)
+        order = keep[np.argsort(pValue[keep], kind='stable')][0:top]
+        return [(self.vocab[k], float(z[k]), float(pValue[k])) for k in order]
+
+    def homogeneity(self, top=20, minCount=5):
+        """Chi-square test (df = years - 1) that a term's share is the same in every year."""
+        years, counts, totals = self.stacked()
+        termTot = counts.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = totals * termTot / totals.sum(axis=0)
+        # the term's cells and the 'all other terms of its order' cells of the 2 x years table
+        otherObs = totals - counts
+        otherExp = totals - expected
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chi2 = np.nansum((counts - expected) ** 2 / expected + (otherObs - otherExp) ** 2 / otherExp, axis=0)
+        pValue = stats.chi2.sf(chi2, len(years) - 1)
+        keep = np.flatnonzero(termTot >= minCount)
+        order = keep[np.argsort(pValue[keep], kind='stable')][0:top]
+        return [(self.vocab[k], float(chi2[k]), float(pValue[k])) for k in order]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cross-year lemma and n-gram trends.')
+    parser.add_argument('--store', default='trendStore')
+    sub = parser.add_subparsers(dest='command', required=True)
+    addParser = sub.add_parser('add', help='add (or replace) one year from a progDict JSON file')
+    addParser.add_argument('year')
+    addParser.add_argument('progFile')
+    addParser.add_argument('--cache-dir', default='stageCache')
+    trendParser = sub.add_parser('trend', help='share of terms per year')
+    trendParser.add_argument('terms', nargs='+')
+    for name in ('rising', 'falling'):
+        movingParser = sub.add_parser(name)
+        movingParser.add_argument('--top', type=int, default=20)
+        movingParser.add_argument('--min-count', type=int, default=5)
+    tracksParser = sub.add_parser('tracks', help='per-track share of a term over time')
+    tracksParser.add_argument('term')
+    compareParser = sub.add_parser('compare', help='terms whose share changed most significantly')
+    compareParser.add_argument('year1')
+    compareParser.add_argument('year2')
+    compareParser.add_argument('--top', type=int, default=20)
+    changedParser = sub.add_parser('changed', help='terms whose share differs most across all years')
+    changedParser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    store = TrendStore(args.store)
+    if args.command == 'add':
+        import nltkBundle
+        import tokenKernel
+        from sensorsPipeline import load_prog_dict, run_pipeline
+        from stageCache import StageCache
+        nltkBundle.use_bundle()
+        progDict = load_prog_dict(args.progFile)
+        outputs, runner = run_pipeline(progDict=progDict, targets=['sessLemmasDict', 'ngrams'],
+                                       cache=StageCache(args.cache_dir))
+        store.add_program(args.year, progDict, outputs['sessLemmasDict'], outputs['ngrams'],
+                          tokenKernel.load_stop_words())
+        print('Years stored:', store.year_list(), 'Vocabulary:', len(store.vocab))
+    elif args.command == 'trend':
+        years, shares = store.trend(args.terms)
+        print('%-24s' % 'term', ' '.join('%9s' % year for year in years))
+        for term, share in shares.items():
+            print('%-24s' % term, ' '.join('%9.5f' % s for s in share))
+    elif args.command in ('rising', 'falling'):
+        for term, slope in store.moving_terms(args.top, args.min_count, falling=args.command == 'falling'):
+            print('%-24s %+.6f' % (term, slope))
+    elif args.command == 'tracks':
+        for year, tracks in store.track_share(args.term).items():
+            print(year)
+            for trkID, (title, share) in tracks.items():
+                print('  ', trkID, '%.5f' % share, title)
+    elif args.command == 'compare':
+        for term, z, pValue in store.compare_years(args.year1, args.year2, args.top):
+            print('%-24s z=%+.2f p=%.4g' % (term, z, pValue))
+    elif args.command == 'changed':
+        for term, chi2, pValue in store.homogeneity(args.top):
+            print('%-24s chi2=%.2f p=%.4g' % (term, chi2, pValue))